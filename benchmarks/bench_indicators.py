@@ -0,0 +1,93 @@
+"""Benchmarks per-ticker compute_indicators against the batched panel and incremental modes.
+
+Both modes copy the EMA/RMA seeding of the pandas-ta version pinned in
+requirements.txt. The script exits with status 1 when any of their
+columns differs from compute_indicators by more than TOLERANCE.
+
+Usage: python benchmarks/bench_indicators.py [n_tickers] [n_days]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from indicators import (  # noqa: E402
+    INDICATOR_COLUMNS, compute_indicators, compute_indicators_incremental, compute_indicators_panel, to_panel,
+)
+
+# Largest allowed difference per indicator value, relative to the value when it is above 1 (e.g. OBV)
+TOLERANCE = 1e-6
+
+def synthetic_histories(n_tickers: int, n_days: int, seed: int = 0, end: str = "2024-12-31") -> dict:
+    """Random-walk OHLCV frames shaped like fetch_history output, with n_days bars up to end."""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=end, periods=n_days, tz="America/New_York")
+    histories = {}
+    for i in range(n_tickers):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n_days)))
+        histories[f"T{i:04d}"] = pd.DataFrame({
+            "Open": close * (1 + rng.normal(0, 0.005, n_days)),
+            "High": close * (1 + np.abs(rng.normal(0, 0.01, n_days))),
+            "Low": close * (1 - np.abs(rng.normal(0, 0.01, n_days))),
+            "Close": close,
+            "Volume": rng.integers(100_000, 5_000_000, n_days),
+            "Dividends": 0.0,
+            "Stock Splits": 0.0,
+        }, index=index)
+    return histories
+
+def max_diffs(frames: dict, expected: dict) -> pd.Series:
+    """Returns each indicator column's largest difference from expected over all tickers (see TOLERANCE)."""
+    diffs = []
+    for ticker, frame in frames.items():
+        index = expected[ticker].index.union(frame.index)
+        want = expected[ticker][INDICATOR_COLUMNS].reindex(index)
+        got = frame[INDICATOR_COLUMNS].reindex(index)
+        diff = (got - want).abs() / want.abs().clip(lower=1)
+        # A row or value present on one side only counts as a mismatch
+        diffs.append(diff.where(got.isna() == want.isna(), np.inf).max())
+    return pd.concat(diffs, axis=1).max(axis=1)
+
+def main():
+    n_tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 252
+    histories = synthetic_histories(n_tickers, n_days)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        loop = {t: compute_indicators(h) for t, h in histories.items()}
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        frames, _ = compute_indicators_panel(to_panel(histories))
+        panel_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        incremental = {t: compute_indicators_incremental(h)[0] for t, h in histories.items()}
+        incremental_time = time.perf_counter() - start
+
+    print(f"{n_tickers} tickers x {n_days} days")
+    print(f"  per-ticker loop: {loop_time:8.3f}s ({loop_time / n_tickers * 1000:.2f} ms/ticker)")
+    print(f"  panel:           {panel_time:8.3f}s ({panel_time / n_tickers * 1000:.2f} ms/ticker)")
+    print(f"  speedup:         {loop_time / panel_time:8.1f}x")
+    print(f"  incremental:     {incremental_time:8.3f}s from scratch "
+          f"({incremental_time / n_tickers * 1000:.2f} ms/ticker)")
+
+    failed = False
+    for mode, results in (("panel", frames), ("incremental", incremental)):
+        diffs = max_diffs(results, loop)
+        print(f"  {mode} max diff: {diffs.max():.3g} (tolerance {TOLERANCE:g})")
+        for column, value in diffs[diffs > TOLERANCE].items():
+            print(f"    {column}: {value:.3g}")
+            failed = True
+    if failed:
+        print("Indicator results differ from compute_indicators; check the pandas-ta version against requirements.txt.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Benchmarks email delivery against the local SMTP sink.
+
+Sends the same batch of per-recipient reports three ways: one connection
+and login per message (send_email in a loop), one pooled connection
+(send_emails), and one pooled connection against a sink that drops the
+session every few messages, which exercises the reconnect path.
+
+Usage: python benchmarks/bench_mailer.py [n_messages] [report_kb]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from smtp_sink import SMTPSink  # noqa: E402
+
+DROP_EVERY = 10
+
+def run(label: str, sink: SMTPSink, send, messages: list):
+    import mailer
+    mailer.SMTP_HOST, mailer.SMTP_PORT, mailer.SMTP_SSL = sink.host, sink.port, False
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        send(messages)
+    seconds = time.perf_counter() - start
+    print(f"  {label:<34} {seconds:8.3f} s {len(messages) / seconds:9.1f} msg/s "
+          f"({sink.messages} delivered, {sink.connections} connections)")
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    report_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    os.environ.update(EMAIL_USER="bench@example.com", EMAIL_PASS="stub")
+    from mailer import send_email, send_emails
+
+    html = "<html><body>" + "<p>report line</p>" * (report_kb * 1024 // 17) + "</body></html>"
+    messages = [{"subject": f"Report {i}", "html_content": html,
+                 "to": [f"team{i}@example.com", f"lead{i}@example.com"]} for i in range(n_messages)]
+    # send_email takes a single address, so this path only mails the first recipient
+    one_by_one = lambda batch: [send_email(m["subject"], m["html_content"], m["to"][0]) for m in batch]
+
+    print(f"{n_messages} messages of ~{report_kb} KB")
+    with SMTPSink() as sink:
+        run("connection per message", sink, one_by_one, messages)
+    with SMTPSink() as sink:
+        run("pooled connection", sink, send_emails, messages)
+    with SMTPSink(max_per_connection=DROP_EVERY) as sink:
+        run(f"pooled, server drops every {DROP_EVERY}", sink, send_emails, messages)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Benchmarks news parsing on saved fixture pages, without network access.
+
+Compares the previous full-document parsers (ET.fromstring + findall for
+RSS, BeautifulSoup html.parser for Yahoo) with the streaming RSS reader
+and the lxml-based Yahoo parser used by fetchers.fetch_news.
+
+Usage: python benchmarks/bench_news_parsing.py [repeat]
+"""
+import io
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from fetchers import _parse_google_rss, _parse_yahoo_page  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+MAX_ITEMS = 5
+
+def full_rss(content: bytes) -> list:
+    root = ET.fromstring(content)
+    return [(item.find('title').text, item.find('link').text) for item in root.findall('.//item')[:MAX_ITEMS]]
+
+def full_yahoo(content: bytes) -> list:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content.decode("utf-8"), 'html.parser')
+    items = soup.select('li.js-stream-content') or soup.select('h3') or []
+    return [item.find('a').get_text(strip=True) for item in items[:MAX_ITEMS]]
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(os.path.join(FIXTURES, "google_news_rss.xml"), "rb") as f:
+        rss = f.read()
+    with open(os.path.join(FIXTURES, "yahoo_quote.html"), "rb") as f:
+        yahoo = f.read()
+
+    assert [a["title"] for a in _parse_google_rss(io.BytesIO(rss), MAX_ITEMS)] == [t for t, _ in full_rss(rss)]
+    print(f"Google News RSS ({len(rss) / 1024:.0f} KiB, {MAX_ITEMS} items)")
+    print(f"  ET.fromstring + findall: {timed(lambda: full_rss(rss), repeat):8.2f} ms")
+    print(f"  streaming iterparse:     {timed(lambda: _parse_google_rss(io.BytesIO(rss), MAX_ITEMS), repeat):8.2f} ms")
+
+    print(f"Yahoo quote page ({len(yahoo) / 1024:.0f} KiB, {MAX_ITEMS} items)")
+    try:
+        assert [a["title"] for a in _parse_yahoo_page(yahoo, MAX_ITEMS)] == full_yahoo(yahoo)
+        print(f"  BeautifulSoup html.parser: {timed(lambda: full_yahoo(yahoo), repeat):8.2f} ms")
+    except ImportError:
+        print("  BeautifulSoup html.parser: skipped (bs4 not installed)")
+    print(f"  lxml targeted:             {timed(lambda: _parse_yahoo_page(yahoo, MAX_ITEMS), repeat):8.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Benchmarks main.run() and each pipeline stage offline, under fixed inputs.
+
+yfinance, the news sites and Groq are replaced by stubs. The stubs serve
+deterministic random-walk histories, the saved news fixtures and canned
+completions. Email goes to a local SMTP sink. The Google News feed gets
+per-ticker headlines and links. The Yahoo page is the same for every
+ticker, like market-wide headlines. Each watchlist size runs in its own
+subprocess and empty working directory, so all stores and caches start
+cold. The pipeline is then run a second time against the warm caches.
+
+Reports seconds, tickers per second and peak traced memory (tracemalloc)
+per stage, plus the process's peak RSS. With RUN_CONCURRENT=1 tracing is
+off, since worker processes would not be traced, and the pools start
+their workers with 'spawn' instead of forking next to the SMTP sink thread. Pipeline options (RUN_CONCURRENT, INDICATOR_MODE,
+...) are read from the environment as usual. CHART_MODE defaults to
+'sparkline' here, because candlestick rendering would dominate large
+watchlists; the chart stage times a sample of candles separately.
+
+Usage: python benchmarks/bench_pipeline.py [--sizes 10,100,1000] [--only stages|pipeline]
+                                           [--llm-latency MS] [--no-trace] [--json PATH]
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(BENCH_DIR, "fixtures")
+RUN_CONCURRENT = os.environ.get("RUN_CONCURRENT", "0").strip().lower() in ("1", "true", "yes")
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from bench_indicators import synthetic_histories  # noqa: E402
+from smtp_sink import SMTPSink  # noqa: E402
+
+N_DAYS = 252
+# Candlestick charts are slow enough that the chart stage only draws this many
+CANDLE_SAMPLE = 5
+
+class StubYFinance:
+    """Stands in for the yfinance module, serving recorded histories."""
+
+    def __init__(self, histories: dict):
+        self.histories = histories
+
+    def _window(self, ticker: str, start=None) -> pd.DataFrame:
+        hist = self.histories.get(ticker)
+        if hist is None:
+            return pd.DataFrame()
+        return hist if start is None else hist[hist.index >= pd.Timestamp(start).tz_localize(hist.index.tz)]
+
+    def download(self, tickers, period=None, start=None, **kwargs) -> pd.DataFrame:
+        frames = {t: self._window(t, start) for t in tickers if t in self.histories}
+        return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+    def Ticker(self, ticker: str):
+        return SimpleNamespace(history=lambda period=None, start=None, **kwargs: self._window(ticker, start))
+
+class _Raw(io.BytesIO):
+    decode_content = False
+
+class _Response:
+    def __init__(self, status_code: int, body: bytes, etag: str):
+        self.status_code, self.headers, self.raw = status_code, {"ETag": etag}, _Raw(body)
+
+    @property
+    def content(self) -> bytes:
+        return self.raw.read()
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class StubSession:
+    """Stands in for the pooled requests session, serving the news fixtures with ETags."""
+
+    def __init__(self):
+        with open(os.path.join(FIXTURES, "google_news_rss.xml"), "rb") as f:
+            self.rss = f.read()
+        with open(os.path.join(FIXTURES, "yahoo_quote.html"), "rb") as f:
+            self.yahoo = f.read()
+        self.requests = 0
+
+    def payload(self, url: str) -> bytes:
+        match = re.search(r"[?&]q=([^+&]+)", url)
+        if "news.google.com" in url and match:
+            ticker = match.group(1).encode("utf-8")
+            return self.rss.replace(b"<title>", b"<title>" + ticker + b" ").replace(b"example?", ticker.lower() + b"?")
+        return self.yahoo
+
+    def get(self, url: str, headers: dict = None, **kwargs) -> _Response:
+        self.requests += 1
+        body = self.payload(url)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return _Response(304, b"", etag)
+        return _Response(200, body, etag)
+
+class StubGroq:
+    """Stands in for groq.Groq, answering every prompt with a canned completion."""
+    latency = 0.0
+
+    def __init__(self, api_key: str = None):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages: list, model: str):
+        import summarizer
+        time.sleep(self.latency)
+        system, user = messages[0]["content"], messages[1]["content"]
+        if system == summarizer.SUMMARY_BATCH_SYSTEM_PROMPT:
+            items = [line.split(". ", 1)[1] for line in user.splitlines() if re.match(r"\d+\. ", line)]
+            content = json.dumps({"summaries": [f"Summary: {item}" for item in items]})
+        else:
+            content = "Summary: " + " ".join(user.split()[-30:])
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)],
+                               usage=SimpleNamespace(total_tokens=(len(system) + len(user)) // 4 + 60))
+
+def install_stubs(n_tickers: int, llm_latency: float, sink: SMTPSink) -> list[str]:
+    """Points every external dependency at the stubs and returns the watchlist."""
+    os.environ.update(sink.env(), GROQ_API_KEY="stub", EMAIL_USER="bench@example.com", EMAIL_PASS="stub",
+                      RECIPIENT_EMAIL="bench@example.com", HOST_MIN_INTERVAL="0")
+    os.environ.setdefault("CHART_MODE", "sparkline")
+    import fetchers
+    import llm_cache
+    histories = synthetic_histories(n_tickers, N_DAYS, end=pd.Timestamp.today().strftime("%Y-%m-%d"))
+    fetchers.yf = StubYFinance(histories)
+    session = StubSession()
+    fetchers.get_session = lambda: session
+    StubGroq.latency = llm_latency
+    llm_cache.groq_class = lambda: StubGroq
+    return list(histories)
+
+@contextlib.contextmanager
+def measured(results: list, name: str, items: int, trace: bool):
+    """Times the block (quietly) and appends its seconds, throughput and peak memory to results."""
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace else 0
+    if trace:
+        tracemalloc.stop()
+    results.append({"stage": name, "items": items, "seconds": seconds,
+                    "per_second": items / seconds if seconds else 0.0, "peak_mb": peak / 2**20})
+
+def bench_stages(tickers: list[str], trace: bool) -> list:
+    """Runs each stage on its own, each one fed the previous stage's output."""
+    from controller import decide_actions, rule_frame, run_controller_batch
+    from fetchers import fetch_history_bulk, fetch_news, flush_validators
+    from indicators import compute_indicators, compute_indicators_panel, to_panel
+    from mailer import send_email
+    from news_index import process_articles_once
+    from price_store import refresh_histories
+    from summarizer import process_articles
+    from utils import CHART_BARS, render_chart, write_html_report
+
+    results, n = [], len(tickers)
+    with measured(results, "history (bulk)", n, trace):
+        histories = fetch_history_bulk(tickers)
+    with measured(results, "history (store, cold)", n, trace):
+        refresh_histories(tickers)
+    with measured(results, "history (store, warm)", n, trace):
+        refresh_histories(tickers)
+    with measured(results, "news fetch (cold)", n, trace):
+        articles = {t: fetch_news(t) for t in tickers}
+        flush_validators()
+    with measured(results, "news fetch (304)", n, trace):
+        for t in tickers:
+            fetch_news(t)
+    with measured(results, "indicators (per ticker)", n, trace):
+        frames = {t: compute_indicators(histories[t]) for t in tickers}
+    with measured(results, "indicators (panel)", n, trace):
+        compute_indicators_panel(to_panel(histories))
+    with measured(results, "summaries (dedup, cold)", n, trace):
+        news = process_articles_once(articles, process_articles)
+    with measured(results, "summaries (dedup, seen)", n, trace):
+        process_articles_once(articles, process_articles)
+    tech = {t: frames[t].iloc[-1].to_dict() for t in tickers}
+    with measured(results, "rules", n, trace):
+        decisions = decide_actions(rule_frame(tech, news))
+    items = [{"ticker": t, "tech": tech[t], "news": news[t], "score": int(decisions.at[t, "score"]),
+              "decision": (decisions.at[t, "action"], decisions.at[t, "reason"])} for t in tickers]
+    with measured(results, "controller", n, trace):
+        outputs = run_controller_batch(items)
+    with measured(results, "chart (sparkline)", n, trace):
+        charts = {t: render_chart(frames[t].tail(CHART_BARS), t, "sparkline") for t in tickers}
+    sample = tickers[:CANDLE_SAMPLE]
+    with measured(results, "chart (candle)", len(sample), trace):
+        for t in sample:
+            render_chart(frames[t].tail(CHART_BARS), t, "candle")
+    report_data = [{"ticker": t, "tech": tech[t], "news": news[t], "chart": charts[t][0], "chart_mime": charts[t][1],
+                    "controller_output": output} for t, output in zip(tickers, outputs)]
+    buf = io.StringIO()
+    with measured(results, "report", n, trace):
+        write_html_report(report_data, buf)
+    with measured(results, "email", 1, trace):
+        send_email("Benchmark report", buf.getvalue(), os.environ["RECIPIENT_EMAIL"])
+    return results
+
+def bench_pipeline(tickers: list[str], trace: bool) -> list:
+    """Runs main.run() twice: with cold stores and caches, then warm."""
+    import main
+    import metrics
+    main.TICKERS = tickers
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    for name in ("pipeline (cold)", "pipeline (warm)"):
+        with measured(results, name, len(tickers), trace):
+            main.run()
+        results[-1]["stages"] = metrics.stage_rows()
+    return results
+
+def run_child(size: int, only: str, llm_latency: float, trace: bool, out_path: str):
+    """Benchmarks one watchlist size inside an empty working directory."""
+    if RUN_CONCURRENT:
+        # A forked worker can inherit a lock held by the sink or tracemalloc and hang
+        multiprocessing.set_start_method("spawn", force=True)
+    with SMTPSink() as sink, tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        tickers = install_stubs(size, llm_latency, sink)
+        results = bench_stages(tickers, trace) if only == "stages" else bench_pipeline(tickers, trace)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "mode": only, "max_rss_mb": rss, "results": results}, f)
+
+def print_results(run: dict):
+    print(f"\n{run['size']} tickers, {run['mode']} (peak RSS {run['max_rss_mb']:.0f} MB)")
+    print(f"  {'stage':<26} {'seconds':>9} {'items/s':>10} {'peak MB':>9}")
+    for row in run["results"]:
+        print(f"  {row['stage']:<26} {row['seconds']:>9.3f} {row['per_second']:>10.1f} {row['peak_mb']:>9.1f}")
+        for stage in row.get("stages", []):
+            print(f"    {stage['stage']:<24} {stage['wall_s']:>9.3f} {'':>10} {'':>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--sizes", default="10,100,1000", help="comma-separated watchlist sizes")
+    parser.add_argument("--only", choices=("stages", "pipeline"), help="run only the stage or pipeline benchmark")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="milliseconds the stub Groq client waits per call")
+    parser.add_argument("--no-trace", action="store_true", help="skip tracemalloc for cleaner timings")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", nargs=2, metavar=("SIZE", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    trace = not args.no_trace and not RUN_CONCURRENT
+    if args.child:
+        run_child(int(args.child[0]), args.only, args.llm_latency / 1000, trace, args.child[1])
+        return
+    if RUN_CONCURRENT and not args.no_trace:
+        print("RUN_CONCURRENT is set: tracemalloc is off (worker processes are not traced).")
+
+    runs = []
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        for mode in [args.only] if args.only else ["stages", "pipeline"]:
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as out:
+                out_path = out.name
+            command = [sys.executable, os.path.abspath(__file__), "--only", mode, "--llm-latency", str(args.llm_latency),
+                       "--child", str(size), out_path] + ([] if trace else ["--no-trace"])
+            try:
+                subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+                with open(out_path, encoding="utf-8") as f:
+                    runs.append(json.load(f))
+            finally:
+                os.remove(out_path)
+            print_results(runs[-1])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(runs, f, indent=2)
+
+if __name__ == "__main__":
+    main()
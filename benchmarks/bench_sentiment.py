@@ -0,0 +1,50 @@
+"""Micro-benchmark for VADER sentiment scoring per article.
+
+Compares building a SentimentIntensityAnalyzer per article (the old
+behaviour) with the shared analyzer and the batch API.
+
+Usage: python benchmarks/bench_sentiment.py [n_articles] [workers]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer  # noqa: E402
+import summarizer  # noqa: E402
+
+HEADLINES = [
+    "Chipmaker shares surge after record quarterly revenue beats estimates",
+    "Stock slumps as regulators open probe into accounting practices",
+    "Company announces new product line at annual developer conference",
+    "Analysts downgrade shares citing weak guidance and rising costs",
+    "Board approves $10 billion buyback and raises dividend",
+]
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    texts = [HEADLINES[i % len(HEADLINES)] for i in range(n)]
+
+    start = time.perf_counter()
+    for text in texts:
+        SentimentIntensityAnalyzer().polarity_scores(text)
+    before = time.perf_counter() - start
+
+    summarizer.get_analyzer()  # lexicon load is paid once per process
+    start = time.perf_counter()
+    for text in texts:
+        summarizer.get_sentiment(text)
+    shared = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summarizer.get_sentiments(texts, workers=workers)
+    batch = time.perf_counter() - start
+
+    print(f"{n} articles")
+    print(f"  analyzer per article: {before / n * 1e6:10.1f} us/article")
+    print(f"  shared analyzer:      {shared / n * 1e6:10.1f} us/article")
+    print(f"  batch (workers={workers}):    {batch / n * 1e6:10.1f} us/article")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Benchmarks CLI start-up: how long `import main` takes and which heavy libraries it loads.
+
+Each measurement runs in a fresh interpreter with `python -X importtime`,
+so nothing is cached in-process between repeats (the OS file cache is
+warm after the first one). Reports the median total, the slowest
+imports made directly by the module and which heavy optional
+dependencies were loaded. Only the pipeline stages that need yfinance,
+pandas_ta, matplotlib/mplfinance, vaderSentiment, groq, requests or lxml
+should load them.
+
+Usage: python benchmarks/bench_startup.py [repeat] [module]
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+HEAVY = ("yfinance", "pandas_ta", "matplotlib", "mplfinance", "vaderSentiment", "groq", "requests", "lxml", "bs4")
+TOP = 8
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def import_profile(module: str) -> tuple[float, dict, list]:
+    """Imports module in a fresh interpreter.
+
+    Returns its total import time in ms, {module it imports directly:
+    cumulative ms} and the heavy modules that ended up loaded.
+    """
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=SRC,
+                            capture_output=True, text=True, check=True)
+    total, children = 0.0, {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        # importtime indents each nesting level by two spaces after a single leading one
+        depth = (len(match.group(3)) - 1) // 2
+        if depth == 0 and match.group(4) == module:
+            total = int(match.group(2)) / 1000
+        elif depth == 1:
+            children[match.group(4)] = int(match.group(2)) / 1000
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return total, children, loaded
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    module = sys.argv[2] if len(sys.argv) > 2 else "main"
+    runs = [import_profile(module) for _ in range(repeat)]
+    totals = [run[0] for run in runs]
+    print(f"import {module}: median {statistics.median(totals):.0f} ms "
+          f"(min {min(totals):.0f}, max {max(totals):.0f}) over {repeat} runs")
+
+    slowest = sorted(runs[-1][1].items(), key=lambda item: item[1], reverse=True)
+    print(f"  slowest imports made by {module} (last run):")
+    for name, millis in slowest[:TOP]:
+        print(f"    {name:<28} {millis:8.1f} ms")
+    loaded = runs[-1][2]
+    print(f"  heavy dependencies loaded: {', '.join(loaded) if loaded else 'none'}")
+
+if __name__ == "__main__":
+    main()
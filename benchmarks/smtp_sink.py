@@ -0,0 +1,117 @@
+"""A minimal local SMTP server that accepts and discards mail, for offline benchmarks.
+
+Speaks just enough SMTP for smtplib (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, RSET, NOOP, QUIT) and counts messages and bytes received. Point the
+mailer at it with SMTP_HOST=127.0.0.1, SMTP_PORT=<port> and SMTP_SSL=0.
+With max_per_connection set, the sink answers 421 and hangs up after that
+many messages on one connection, like providers that cap sessions.
+
+Usage: python benchmarks/smtp_sink.py [port] [max_per_connection]
+"""
+import socketserver
+import sys
+import threading
+import time
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections += 1
+        self.reply("220 sink ESMTP ready")
+        recipients = accepted = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.wfile.write(b"250-sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif verb == "AUTH":
+                # Any credentials are accepted; only the prompts smtplib expects are sent
+                parts = command.split()
+                mechanism = parts[1].upper() if len(parts) > 1 else ""
+                prompts = []
+                if mechanism == "LOGIN":
+                    prompts = ["334 VXNlcm5hbWU6"] * (len(parts) == 2) + ["334 UGFzc3dvcmQ6"]
+                elif len(parts) == 2:
+                    prompts = ["334 "]
+                for prompt in prompts:
+                    self.reply(prompt)
+                    self.rfile.readline()
+                self.reply("235 accepted")
+            elif verb == "MAIL":
+                if sink.max_per_connection and accepted >= sink.max_per_connection:
+                    self.reply("421 too many messages on this connection")
+                    return
+                recipients = 0
+                self.reply("250 ok")
+            elif verb == "RCPT":
+                recipients += 1
+                self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                size = 0
+                for data in iter(self.rfile.readline, b""):
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    size += len(data)
+                accepted += 1
+                with sink.lock:
+                    sink.messages += 1
+                    sink.recipients += recipients
+                    sink.bytes += size
+                self.reply("250 queued")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                # RSET, NOOP and anything else is acknowledged and ignored
+                self.reply("250 ok")
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SMTPSink:
+    """Runs the sink on a background thread; use as a context manager."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, max_per_connection: int = 0):
+        self.server = _Server((host, port), _Handler)
+        self.max_per_connection = max_per_connection
+        self.server.sink = self
+        self.host, self.port = self.server.server_address[:2]
+        self.lock = threading.Lock()
+        self.connections = self.messages = self.recipients = self.bytes = 0
+
+    def env(self) -> dict:
+        """Environment variables that point mailer at this sink."""
+        return {"SMTP_HOST": self.host, "SMTP_PORT": str(self.port), "SMTP_SSL": "0"}
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8025
+    max_per_connection = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    with SMTPSink(port=port, max_per_connection=max_per_connection) as sink:
+        print(f"SMTP sink listening on {sink.host}:{sink.port} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(5)
+                print(f"  {sink.messages} messages, {sink.recipients} recipients, "
+                      f"{sink.bytes / 1024:.0f} KiB over {sink.connections} connections")
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
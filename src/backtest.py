@@ -0,0 +1,152 @@
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from controller import RULES, rule_masks
+from fetchers import fetch_history_bulk
+from indicators import compute_indicators, compute_indicators_panel, to_panel
+from price_store import load_histories, save_histories
+
+# Forward-return horizons, in trading days, measured from each signal bar's close
+HORIZONS = (1, 5, 20)
+# Calendar days downloaded before the start date so SMA 50 / volatility 30 are warm on day one
+WARMUP_DAYS = 120
+
+def load_backtest_histories(tickers: list[str], start, refresh: bool = False) -> dict:
+    """Returns stored daily bars for the tickers; refresh=True first downloads them from before start.
+
+    Downloaded bars are saved to the price store, so later backtests over
+    the same range need no network access.
+    """
+    if refresh:
+        since = (pd.Timestamp(start) - pd.Timedelta(days=WARMUP_DAYS)).strftime("%Y-%m-%d")
+        save_histories(fetch_history_bulk(tickers, start=since))
+    histories = load_histories(tickers)
+    missing = [t for t in tickers if t not in histories]
+    if missing:
+        logging.warning(f"No stored bars for {', '.join(missing)}; run with --refresh to download them.")
+    return histories
+
+def signal_frame(histories: dict, start=None, end=None, horizons=HORIZONS, rules: list[dict] = None,
+                 mode: str = "panel") -> pd.DataFrame:
+    """Evaluates the rules on every bar of every ticker between start and end.
+
+    Indicators are computed once per ticker over the whole history (mode
+    'panel' batches all tickers; 'full' runs compute_indicators per ticker,
+    with the same results), so bars right after start are already warm.
+    Rules need their columns in the bars, so the news rule is skipped.
+    Returns one row per (ticker, date) with Close, the indicators, a
+    boolean column per rule, 'score' (rules fired), 'action' and the
+    forward returns fwd_<h>d (NaN when the history ends too soon).
+    """
+    if mode == "panel":
+        frames, _ = compute_indicators_panel(to_panel(histories))
+    else:
+        frames = {ticker: compute_indicators(hist) for ticker, hist in histories.items()}
+    frames = {ticker: frame for ticker, frame in frames.items() if not frame.empty}
+    if not frames:
+        return pd.DataFrame()
+    bars = pd.concat(frames, names=["ticker", "date"])
+
+    # Forward returns use the bars after end too, so late signals are still scored
+    close = bars["Close"].groupby(level="ticker")
+    for h in horizons:
+        bars[f"fwd_{h}d"] = close.shift(-h) / bars["Close"] - 1
+
+    dates = bars.index.get_level_values("date")
+    keep = np.ones(len(bars), dtype=bool)
+    if start is not None:
+        keep &= dates >= _localize(start, dates)
+    if end is not None:
+        keep &= dates <= _localize(end, dates)
+    bars = bars[keep]
+
+    # Rules on inputs without history (e.g. negative_news_count) are left out
+    rules = [rule for rule in rules or RULES if {rule["column"], rule.get("other", rule["column"])} <= set(bars.columns)]
+    masks = rule_masks(bars, rules)
+    bars = bars.join(masks)
+    bars["score"] = masks.sum(axis=1)
+    bars["action"] = np.where(bars["score"] > 0, "ESCALATE", "MONITOR")
+    return bars
+
+def _localize(when, dates: pd.DatetimeIndex) -> pd.Timestamp:
+    when = pd.Timestamp(when)
+    if dates.tz is not None and when.tz is None:
+        return when.tz_localize(dates.tz)
+    return when
+
+def signal_stats(bars: pd.DataFrame, horizons=HORIZONS, rules: list[dict] = None) -> pd.DataFrame:
+    """Summarizes each rule, ESCALATE, MONITOR and all bars: signal count, tickers and forward returns.
+
+    For every horizon it reports the mean and median forward return and
+    the hit rate (share of signals followed by a positive return).
+    """
+    groups = {"all bars": np.ones(len(bars), dtype=bool)}
+    groups.update((name, bars[name].to_numpy(dtype=bool)) for name in _rule_names(bars, rules))
+    groups["ESCALATE"] = (bars["action"] == "ESCALATE").to_numpy()
+    groups["MONITOR"] = (bars["action"] == "MONITOR").to_numpy()
+
+    tickers = bars.index.get_level_values("ticker")
+    rows = {}
+    for name, mask in groups.items():
+        row = {"signals": int(mask.sum()), "tickers": tickers[mask].nunique()}
+        for h in horizons:
+            returns = bars[f"fwd_{h}d"].to_numpy()[mask]
+            returns = returns[~np.isnan(returns)]
+            row[f"fwd_{h}d_mean"] = returns.mean() if len(returns) else np.nan
+            row[f"fwd_{h}d_median"] = np.median(returns) if len(returns) else np.nan
+            row[f"fwd_{h}d_hit_rate"] = (returns > 0).mean() if len(returns) else np.nan
+        rows[name] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+def _rule_names(bars: pd.DataFrame, rules: list[dict] = None) -> list[str]:
+    return [rule["name"] for rule in rules or RULES if rule["name"] in bars.columns]
+
+def ticker_counts(bars: pd.DataFrame, rules: list[dict] = None) -> pd.DataFrame:
+    """Counts bars, ESCALATE bars and firings of each rule per ticker."""
+    columns = _rule_names(bars, rules)
+    counts = bars[columns].groupby(level="ticker").sum()
+    counts.insert(0, "escalate", (bars["action"] == "ESCALATE").groupby(level="ticker").sum())
+    counts.insert(0, "bars", bars.groupby(level="ticker").size())
+    return counts
+
+def run_backtest(tickers: list[str], start, end, horizons=HORIZONS, refresh: bool = False,
+                 mode: str = "panel") -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Backtests the escalation rules over cached daily bars; returns (bars, stats, per-ticker counts)."""
+    histories = load_backtest_histories(tickers, start, refresh=refresh)
+    bars = signal_frame(histories, start, end, horizons, mode=mode)
+    if bars.empty:
+        raise ValueError("No bars to backtest; check the tickers and date range, or use --refresh.")
+    return bars, signal_stats(bars, horizons), ticker_counts(bars)
+
+def cli(argv: list[str] = None):
+    """Command-line entry point: python src/backtest.py --start 2020-01-01 [--end ...] [--tickers ...]."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description="Backtests the escalation rules over cached price data.")
+    parser.add_argument('--tickers', default=os.environ.get('TICKERS', 'AMD,AVGO'), help="comma-separated symbols")
+    parser.add_argument('--start', required=True, help="first signal date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="last signal date (default: latest stored bar)")
+    parser.add_argument('--horizons', default=",".join(map(str, HORIZONS)), help="forward-return horizons in trading days")
+    parser.add_argument('--refresh', action='store_true', help="download the range into the price store first")
+    parser.add_argument('--mode', choices=('panel', 'full'), default='panel', help="indicator computation (same results)")
+    parser.add_argument('--out', default='report', help="directory for backtest_signals.csv, backtest_stats.csv and backtest_tickers.csv")
+    args = parser.parse_args(argv)
+
+    tickers = [t.strip().upper() for t in args.tickers.split(',') if t.strip()]
+    horizons = tuple(int(h) for h in args.horizons.split(',') if h.strip())
+    bars, stats, counts = run_backtest(tickers, args.start, args.end, horizons, refresh=args.refresh, mode=args.mode)
+
+    os.makedirs(args.out, exist_ok=True)
+    signals = bars[bars["action"] == "ESCALATE"]
+    signals.to_csv(os.path.join(args.out, "backtest_signals.csv"))
+    stats.to_csv(os.path.join(args.out, "backtest_stats.csv"))
+    counts.to_csv(os.path.join(args.out, "backtest_tickers.csv"))
+    with pd.option_context('display.width', 160, 'display.max_columns', None, 'display.float_format', '{:.4f}'.format):
+        logging.info(f"Backtest of {counts.shape[0]} tickers, {len(bars)} bars:\n{stats}")
+    logging.info(f"{len(signals)} ESCALATE bars and the summaries written to {args.out}/")
+
+if __name__ == '__main__':
+    cli()
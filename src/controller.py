@@ -1,8 +1,26 @@
+import operator
 import os
-try:
-    from groq import Groq
-except Exception:
-    Groq = None
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from llm_cache import LLMBudgetExceeded, cached_completion, get_client, new_budget
+
+ANALYST_SYSTEM_PROMPT = "You are an expert AI financial analyst. Provide a brief, balanced, and actionable synthesis of the provided technical and news data."
+
+# Which tickers get an LLM analyst opinion: 'all', 'escalate' (ESCALATE only) or
+# 'topk' (the ANALYST_TOP_K highest-scoring ESCALATE tickers); the rest get the rule text
+ANALYST_GATING_MODES = ("all", "escalate", "topk")
+ANALYST_GATING = os.environ.get("ANALYST_GATING", "all").strip().lower()
+if ANALYST_GATING not in ANALYST_GATING_MODES:
+    print(f"Warning: unknown ANALYST_GATING '{ANALYST_GATING}' (expected one of "
+          f"{', '.join(ANALYST_GATING_MODES)}); using 'all'.")
+    ANALYST_GATING = "all"
+ANALYST_TOP_K = int(os.environ.get("ANALYST_TOP_K", 10))
+# Per-run limits on analyst completions (0 = unlimited)
+ANALYST_MAX_REQUESTS = int(os.environ.get("ANALYST_MAX_REQUESTS", 0))
+ANALYST_MAX_TOKENS = int(os.environ.get("ANALYST_MAX_TOKENS", 0))
 
 def _fmt_num(v):
     try:
@@ -10,39 +28,118 @@ def _fmt_num(v):
     except Exception:
         return "N/A"
 
-def decide_action_with_rules(tech_summary: dict, news_summaries: list[dict]) -> tuple[str, str]:
-    """Simple rule-based logic to decide an action."""
-    reasons = []
+# Declarative escalation rules. A rule fires when `column <op> value`, or `column <op> other`
+# for a column-to-column comparison. `default`/`other_default` stand in for a field that is
+# missing; values that are not numeric never fire. `reason` may use {value} (the column value).
+RULES = [
+    {"name": "rsi_overbought", "column": "RSI_14", "op": ">=", "value": 70, "default": 50,
+     "reason": "RSI is overbought (>= 70)."},
+    {"name": "rsi_oversold", "column": "RSI_14", "op": "<=", "value": 30, "default": 50,
+     "reason": "RSI is oversold (<= 30)."},
+    {"name": "below_sma50", "column": "Close", "op": "<", "other": "SMA_50", "default": 0, "other_default": float('inf'),
+     "reason": "Price crossed below 50-day SMA."},
+    {"name": "negative_news", "column": "negative_news_count", "op": ">=", "value": 2, "default": 0,
+     "reason": "High volume of negative news ({value:.0f} articles)."},
+]
+NEGATIVE_NEWS_THRESHOLD = -0.2
+_OPS = {
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "==": operator.eq, "!=": operator.ne,
+}
 
-    # Technical Rules
-    try:
-        if float(tech_summary.get('RSI_14', 50)) >= 70:
-            reasons.append("RSI is overbought (>= 70).")
-    except Exception:
-        pass
-    try:
-        if float(tech_summary.get('RSI_14', 50)) <= 30:
-            reasons.append("RSI is oversold (<= 30).")
-    except Exception:
-        pass
-    try:
-        if float(tech_summary.get('Close', 0)) < float(tech_summary.get('SMA_50', float('inf'))):
-            reasons.append("Price crossed below 50-day SMA.")
-    except Exception:
-        pass
+def negative_news_count(news_summaries: list[dict]) -> int:
+    return sum(1 for article in news_summaries if article.get('sentiment_score', 0) <= NEGATIVE_NEWS_THRESHOLD)
 
-    # News Rules
-    negative_news_count = sum(1 for article in news_summaries if article.get('sentiment_score', 0) <= -0.2)
-    if negative_news_count >= 2:
-        reasons.append(f"High volume of negative news ({negative_news_count} articles).")
+def decide_action_with_rules(tech_summary: dict, news_summaries: list[dict], rules: list[dict] = None) -> tuple[str, str]:
+    """Simple rule-based logic to decide an action."""
+    fields = dict(tech_summary, negative_news_count=negative_news_count(news_summaries))
+    reasons = []
+    for rule in rules or RULES:
+        try:
+            value = float(fields.get(rule["column"], rule.get("default")))
+            other = float(fields.get(rule["other"], rule.get("other_default"))) if "other" in rule else float(rule["value"])
+            if _OPS[rule["op"]](value, other):
+                reasons.append(rule["reason"].format(value=value))
+        except Exception:
+            pass
 
     if reasons:
         return "ESCALATE", " & ".join(reasons)
 
     return "MONITOR", "No significant triggers met."
 
+def _evaluate_rule(frame: pd.DataFrame, rule: dict) -> tuple[np.ndarray, np.ndarray]:
+    """Returns a rule's column values and its boolean mask over every row of frame."""
+    n = len(frame)
+
+    def column(name, default):
+        try:
+            default = float(default)
+        except (TypeError, ValueError):
+            default = np.nan
+        if name not in frame.columns:
+            return np.full(n, default)
+        values = pd.to_numeric(frame[name], errors="coerce").to_numpy(dtype=float)
+        missing = frame.attrs.get("missing", {}).get(name)
+        return values if missing is None else np.where(missing, default, values)
+
+    values = column(rule["column"], rule.get("default"))
+    other = column(rule["other"], rule.get("other_default")) if "other" in rule else float(rule["value"])
+    with np.errstate(invalid="ignore"):
+        return values, _OPS[rule["op"]](values, other)
+
+def rule_masks(frame: pd.DataFrame, rules: list[dict] = None) -> pd.DataFrame:
+    """Evaluates every rule over every row of frame; one boolean column per rule name.
+
+    Rows can be anything with the rule columns, e.g. every bar of every
+    ticker for a backtest. Missing columns, and the rows that rule_frame
+    marked as lacking a key, use the rule defaults.
+    """
+    return pd.DataFrame({rule["name"]: _evaluate_rule(frame, rule)[1] for rule in rules or RULES}, index=frame.index)
+
+def decide_actions(latest: pd.DataFrame, rules: list[dict] = None) -> pd.DataFrame:
+    """Vectorized decide_action_with_rules over one row of latest indicators per ticker.
+
+    latest should carry a negative_news_count column (see rule_frame).
+    Returns a frame with the same index and 'action', 'reason' and
+    'score' (number of rules that fired) columns, evaluated in one pass of
+    boolean masks; each row matches decide_action_with_rules for that ticker.
+    """
+    n = len(latest)
+    reasons = np.full(n, "", dtype=object)
+    fired = np.zeros(n, dtype=int)
+
+    for rule in rules or RULES:
+        values, mask = _evaluate_rule(latest, rule)
+        if not mask.any():
+            continue
+        if "{value" in rule["reason"]:
+            text = np.array([rule["reason"].format(value=v) if m else "" for v, m in zip(values, mask)], dtype=object)
+        else:
+            text = rule["reason"]
+        joined = np.where(reasons == "", text, reasons + " & " + text)
+        reasons = np.where(mask, joined, reasons)
+        fired += mask
+
+    return pd.DataFrame({
+        "action": np.where(fired > 0, "ESCALATE", "MONITOR"),
+        "reason": np.where(fired > 0, reasons, "No significant triggers met."),
+        "score": fired,
+    }, index=latest.index)
+
+def rule_frame(tech_by_ticker: dict[str, dict], news_by_ticker: dict[str, list[dict]]) -> pd.DataFrame:
+    """Builds the one-row-per-ticker input for decide_actions.
+
+    Keys that only some tickers have are recorded in attrs['missing'], so
+    the other tickers get the rule defaults like decide_action_with_rules.
+    """
+    techs = list(tech_by_ticker.values())
+    frame = pd.DataFrame(techs, index=list(tech_by_ticker))
+    missing = {column: np.array([column not in tech for tech in techs]) for column in frame.columns}
+    frame.attrs["missing"] = {column: mask for column, mask in missing.items() if mask.any()}
+    frame["negative_news_count"] = [negative_news_count(news_by_ticker.get(t, [])) for t in frame.index]
+    return frame
 
-def get_analyst_opinion(client, ticker: str, tech_summary: dict, news_summaries: list[dict]) -> str:
+def get_analyst_opinion(client, ticker: str, tech_summary: dict, news_summaries: list[dict], budget: dict = None) -> str:
     """Uses Groq to provide a high-level opinion on the current situation."""
     prompt_context = f"""
     Analyze the following data for the stock ticker {ticker} and provide a one-paragraph summary for an investor.
@@ -69,31 +166,20 @@ def get_analyst_opinion(client, ticker: str, tech_summary: dict, news_summaries:
         return f"{action}: {reason} (No AI analyst available - GROQ_API_KEY missing or groq library not installed.)"
 
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert AI financial analyst. Provide a brief, balanced, and actionable synthesis of the provided technical and news data."
-                },
-                {
-                    "role": "user",
-                    "content": prompt_context,
-                }
-            ],
-            model="llama3-8b-8192",
-        )
-        return chat_completion.choices[0].message.content
+        return cached_completion(client, "llama3-8b-8192", ANALYST_SYSTEM_PROMPT, prompt_context, budget=budget)
+    except LLMBudgetExceeded as e:
+        action, reason = decide_action_with_rules(tech_summary, news_summaries)
+        return f"{action}: {reason} (AI analyst skipped: {e}.)"
     except Exception as e:
         print(f"Error getting analyst opinion from Groq: {e}")
         action, reason = decide_action_with_rules(tech_summary, news_summaries)
         return f"{action}: {reason} (AI analyst failed.)"
 
-def run_controller(ticker: str, tech_summary: dict, news_summaries: list[dict]) -> dict:
-    """Orchestrates the decision-making process."""
-    groq_key = os.environ.get("GROQ_API_KEY")
-    client = Groq(api_key=groq_key) if (Groq is not None and groq_key) else None
+def run_controller(ticker: str, tech_summary: dict, news_summaries: list[dict], decision: tuple[str, str] = None) -> dict:
+    """Orchestrates the decision-making process (decision: a precomputed (action, reason))."""
+    client = get_client()
 
-    action, reason = decide_action_with_rules(tech_summary, news_summaries)
+    action, reason = decision or decide_action_with_rules(tech_summary, news_summaries)
     analyst_opinion = get_analyst_opinion(client, ticker, tech_summary, news_summaries)
 
     print(f"Controller decision for {ticker}: {action} because {reason}")
@@ -102,3 +188,65 @@ def run_controller(ticker: str, tech_summary: dict, news_summaries: list[dict])
         "reason": reason,
         "analyst_opinion": analyst_opinion
     }
+
+def _analyst_candidates(items: list[dict], gating: str, top_k: int) -> set[int]:
+    """Returns the indices of the items that should get an LLM opinion."""
+    if gating == "all":
+        return set(range(len(items)))
+    escalated = [i for i, item in enumerate(items) if item["decision"][0] == "ESCALATE"]
+    if gating == "escalate":
+        return set(escalated)
+    if gating == "topk":
+        def rank(i):
+            try:
+                rsi_distance = abs(float(items[i]["tech"].get("RSI_14", 50)) - 50)
+            except (TypeError, ValueError):
+                rsi_distance = 0.0
+            return (items[i].get("score", 0), rsi_distance)
+        return set(sorted(escalated, key=rank, reverse=True)[:max(0, top_k)])
+    raise ValueError(f"Unknown analyst gating mode: {gating}")
+
+def run_controller_batch(items: list[dict], workers: int = 1, gating: str = None, top_k: int = None,
+                         max_requests: int = None, max_tokens: int = None) -> list[dict]:
+    """Runs the controller for many tickers with one shared Groq client.
+
+    items are dicts with 'ticker', 'tech', 'news', 'decision' ((action,
+    reason) from decide_actions) and optionally 'score'. Only tickers
+    selected by the gating mode are sent to the LLM, on up to `workers`
+    concurrent calls within the per-run request/token budget; every other
+    ticker, and any ticker past the budget, gets the rule text instead.
+    Returns run_controller-style dicts in input order.
+    """
+    gating = gating or ANALYST_GATING
+    top_k = ANALYST_TOP_K if top_k is None else top_k
+    budget = new_budget(ANALYST_MAX_REQUESTS if max_requests is None else max_requests,
+                        ANALYST_MAX_TOKENS if max_tokens is None else max_tokens)
+    client = get_client()
+
+    candidates = _analyst_candidates(items, gating, top_k)
+    opinions = {}
+    for i, item in enumerate(items):
+        if i not in candidates:
+            action, reason = item["decision"]
+            opinions[i] = f"{action}: {reason} (AI analyst not requested for this ticker.)"
+
+    ask = lambda i: get_analyst_opinion(client, items[i]["ticker"], items[i]["tech"], items[i]["news"], budget=budget)
+    selected = sorted(candidates)
+    if workers > 1 and len(selected) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            opinions.update(zip(selected, executor.map(ask, selected)))
+    else:
+        opinions.update((i, ask(i)) for i in selected)
+
+    outputs = []
+    for i, item in enumerate(items):
+        action, reason = item["decision"]
+        print(f"Controller decision for {item['ticker']}: {action} because {reason}")
+        outputs.append({
+            "action": action,
+            "reason": reason,
+            "analyst_opinion": opinions[i]
+        })
+    print(f"Analyst opinions requested for {len(selected)}/{len(items)} tickers ({gating}); "
+          f"{budget['requests']} API requests, ~{budget['tokens']} tokens.")
+    return outputs
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import StringIO
+
+import pandas as pd
+
+import metrics
+from controller import decide_actions, rule_frame, run_controller_batch
+from fetchers import fetch_history_bulk, fetch_news, flush_validators
+from indicators import compute_indicators_panel, to_panel
+from mailer import send_email
+from news_index import process_articles_once
+from price_store import refresh_histories
+from summarizer import process_articles
+from utils import CHART_BARS, render_chart, write_html_report
+
+# Seconds between two polls of intraday bars, and of the news feeds
+PRICE_POLL_INTERVAL = int(os.environ.get('DAEMON_PRICE_INTERVAL', 300))
+NEWS_POLL_INTERVAL = int(os.environ.get('DAEMON_NEWS_INTERVAL', 900))
+# Bar size of the intraday poll; the bars are folded into today's daily bar
+INTRADAY_INTERVAL = os.environ.get('INTRADAY_INTERVAL', '5m')
+# Poll intraday bars only during US regular trading hours (news is polled around the clock)
+MARKET_HOURS_ONLY = os.environ.get('MARKET_HOURS_ONLY', '1').strip().lower() in ('1', 'true', 'yes')
+MARKET_TZ = 'America/New_York'
+MARKET_OPEN, MARKET_CLOSE = (9, 30), (16, 0)
+
+def market_open(now: pd.Timestamp = None) -> bool:
+    """True during US regular trading hours (weekdays 9:30-16:00 New York; holidays are not known)."""
+    now = (now or pd.Timestamp.now(tz=MARKET_TZ)).tz_convert(MARKET_TZ)
+    return now.weekday() < 5 and MARKET_OPEN <= (now.hour, now.minute) < MARKET_CLOSE
+
+def merge_intraday(hist: pd.DataFrame, bars: pd.DataFrame) -> pd.DataFrame:
+    """Folds the latest session's intraday bars into the daily history as a provisional bar.
+
+    The provisional bar replaces any stored bar for that day, so each poll
+    moves it forward until the price store records the final one.
+    """
+    if hist.empty or bars is None or bars.empty:
+        return hist
+    local = bars.index
+    if local.tz is not None:
+        local = local.tz_convert(hist.index.tz or MARKET_TZ)
+        if hist.index.tz is None:
+            local = local.tz_localize(None)
+    days = local.normalize()
+    day = days[-1]
+    if day < hist.index[-1]:
+        return hist
+    session = bars[days == day]
+    row = {"Open": session["Open"].iloc[0], "High": session["High"].max(), "Low": session["Low"].min(),
+           "Close": session["Close"].iloc[-1], "Volume": session["Volume"].sum()}
+    bar = pd.DataFrame([row], index=pd.DatetimeIndex([day], name=hist.index.name))
+    return pd.concat([hist[hist.index < day], bar.reindex(columns=hist.columns, fill_value=0.0)])
+
+def fingerprint(hist: pd.DataFrame, articles: list[dict]) -> str:
+    """Hashes what a ticker's evaluation depends on: its latest bar, bar count and headlines."""
+    digest = hashlib.sha256()
+    digest.update(str(len(hist)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(hist.tail(1), index=True).to_numpy().tobytes())
+    digest.update(json.dumps([(a.get('title'), a.get('link')) for a in articles]).encode('utf-8'))
+    return digest.hexdigest()
+
+def poll_prices(tickers: list[str], intraday: bool) -> dict:
+    """Returns daily histories from the price store, with today's intraday bars folded in when asked."""
+    histories = refresh_histories(tickers)
+    if intraday:
+        bars = fetch_history_bulk(list(histories), period='1d', interval=INTRADAY_INTERVAL)
+        histories = {t: merge_intraday(hist, bars.get(t)) for t, hist in histories.items()}
+    return histories
+
+def poll_news(tickers: list[str], workers: int = 1) -> dict:
+    """Fetches every ticker's news through the shared session; unchanged feeds answer 304."""
+    def fetch(ticker):
+        try:
+            return fetch_news(ticker)
+        except Exception as e:
+            logging.warning(f"News poll failed for {ticker}: {e}")
+            return None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        fetched = dict(zip(tickers, executor.map(fetch, tickers)))
+    flush_validators()
+    return {t: articles for t, articles in fetched.items() if articles is not None}
+
+def evaluate(histories: dict, articles: dict, workers: int = 1) -> dict:
+    """Runs indicators, news processing, rules and the controller for the given tickers.
+
+    Returns {ticker: {'hist_with_indicators', 'tech', 'news', 'controller_output'}};
+    tickers left without indicator rows are logged and omitted.
+    """
+    with metrics.track('indicators'):
+        frames, _ = compute_indicators_panel(to_panel(histories))
+    results = {}
+    for ticker, frame in frames.items():
+        if frame.empty:
+            logging.warning(f"No data after computing indicators for {ticker}; skipping it.")
+            continue
+        results[ticker] = {'hist_with_indicators': frame, 'tech': frame.iloc[-1].to_dict()}
+    if not results:
+        return results
+
+    with metrics.track('summaries'), ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        news = process_articles_once({t: articles.get(t, []) for t in results}, process_articles, executor, workers)
+    with metrics.track('controller'):
+        tickers = list(results)
+        decisions = decide_actions(rule_frame({t: results[t]['tech'] for t in tickers}, news))
+        items = [{'ticker': t, 'tech': results[t]['tech'], 'news': news[t], 'score': int(decisions.at[t, 'score']),
+                  'decision': (decisions.at[t, 'action'], decisions.at[t, 'reason'])} for t in tickers]
+        for t, output in zip(tickers, run_controller_batch(items, workers=workers)):
+            results[t].update(news=news[t], controller_output=output)
+    return results
+
+def send_alert(crossed: dict, recipient_email: str, dry_run: bool = False):
+    """Emails a short report for the tickers that just crossed from MONITOR to ESCALATE."""
+    report_data = []
+    for ticker, result in crossed.items():
+        chart, mime = render_chart(result['hist_with_indicators'].tail(CHART_BARS), ticker, 'sparkline')
+        report_data.append({'ticker': ticker, 'tech': result['tech'], 'news': result['news'], 'chart': chart,
+                            'chart_mime': mime, 'controller_output': result['controller_output']})
+    logging.info(f"Escalated since the last evaluation: {', '.join(crossed)}")
+    if dry_run or not recipient_email:
+        logging.info("Dry run or no recipient configured; not sending the alert.")
+        return
+    buf = StringIO()
+    write_html_report(report_data, buf)
+    with metrics.track('email'):
+        send_email(
+            subject=f"Stock Watcher Alert - {', '.join(crossed)} escalated - {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+            html_content=buf.getvalue(),
+            to_email=recipient_email,
+        )
+
+def run_forever(tickers: list[str], recipient_email: str = None, workers: int = 4, dry_run: bool = False,
+                max_cycles: int = None):
+    """Keeps the agent running, re-evaluating only the tickers whose inputs changed.
+
+    Prices are polled every PRICE_POLL_INTERVAL seconds (intraday bars only
+    during market hours when MARKET_HOURS_ONLY is set) and news every
+    NEWS_POLL_INTERVAL seconds. The price store, HTTP session and
+    validators, article store, LLM cache, VADER analyzer and Groq client
+    all live in this process, so every cycle after the first runs warm.
+    A ticker whose action moves from MONITOR to ESCALATE triggers an alert;
+    the first evaluation of each ticker only sets its baseline.
+    """
+    logging.info(f"🚀 Starting the stock watcher daemon for {len(tickers)} tickers "
+                 f"(prices every {PRICE_POLL_INTERVAL}s, news every {NEWS_POLL_INTERVAL}s)...")
+    histories, articles, fingerprints, actions = {}, {}, {}, {}
+    next_prices = next_news = 0.0
+    cycle = 0
+    try:
+        while max_cycles is None or cycle < max_cycles:
+            cycle += 1
+            metrics.reset()
+            now = time.monotonic()
+            if now >= next_prices:
+                is_open = market_open()
+                # Daily bars are always loaded once; afterwards prices only move while the market is open
+                if is_open or not MARKET_HOURS_ONLY or not histories:
+                    with metrics.track('history'):
+                        histories.update(poll_prices(tickers, intraday=is_open or not MARKET_HOURS_ONLY))
+                next_prices = now + PRICE_POLL_INTERVAL
+            if now >= next_news:
+                with metrics.track('news'):
+                    articles.update(poll_news(tickers, workers))
+                next_news = now + NEWS_POLL_INTERVAL
+
+            current = {t: fingerprint(histories[t], articles.get(t, [])) for t in tickers if t in histories}
+            changed = [t for t in current if current[t] != fingerprints.get(t)]
+            if changed:
+                logging.info(f"Cycle {cycle}: re-evaluating {len(changed)}/{len(tickers)} tickers with new inputs.")
+                try:
+                    results = evaluate({t: histories[t] for t in changed}, articles, workers)
+                except Exception as e:
+                    # Fingerprints stay unchanged, so these tickers are retried next cycle
+                    logging.exception(f"Evaluation failed: {e}")
+                    results = {}
+                crossed = {}
+                for ticker, result in results.items():
+                    action = result['controller_output']['action']
+                    if actions.get(ticker) == 'MONITOR' and action == 'ESCALATE':
+                        crossed[ticker] = result
+                    actions[ticker], fingerprints[ticker] = action, current[ticker]
+                if crossed:
+                    send_alert(crossed, recipient_email, dry_run)
+                metrics.log_summary()
+
+            if max_cycles is None or cycle < max_cycles:
+                time.sleep(max(1.0, min(next_prices, next_news) - time.monotonic()))
+    except KeyboardInterrupt:
+        logging.info("Stopping the stock watcher daemon.")
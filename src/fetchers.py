@@ -1,17 +1,156 @@
+import json
+import os
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urlparse
+
 import pandas as pd
-import yfinance as yf
-import requests
-from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 from typing import List, Dict
 
+import metrics
+
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0 Safari/537.36"
 REQUEST_TIMEOUT = 10
+HISTORY_CHUNK_SIZE = 50
+# Keep-alive connections kept per host by the shared session
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+# Minimum delay between two requests to the same host, so concurrent fetching stays polite
+HOST_MIN_INTERVAL = float(os.environ.get("HOST_MIN_INTERVAL", 0.5))
+# ETag/Last-Modified validators and the articles parsed from each news URL
+VALIDATOR_STORE_PATH = os.environ.get("VALIDATOR_STORE_PATH", os.path.join("data", "http_validators.json"))
+# Column order returned by yf.Ticker().history(), which yf.download does not preserve
+HISTORY_COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Dividends", "Stock Splits", "Capital Gains"]
+
+# yfinance, requests and lxml are imported by the first call that needs them (see _yfinance
+# and get_session), so runs served from the price store and HTTP validators start faster
+yf = None
+_session = None
+_session_lock = threading.Lock()
+_host_next_slot = {}
+_host_lock = threading.Lock()
+_validators = None
+_validators_dirty = False
+_validators_lock = threading.Lock()
+
+def _yfinance():
+    """Returns the yfinance module, importing it on first use."""
+    global yf
+    if yf is None:
+        import yfinance
+        yf = yfinance
+    return yf
+
+def get_session():
+    """Returns the module-wide pooled requests.Session with keep-alive and retry/backoff."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                              allowed_methods=["GET"], respect_retry_after_header=True)
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.headers.update({"User-Agent": USER_AGENT})
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def _wait_for_host(url: str):
+    """Blocks until the per-host rate limit allows another request to url's host."""
+    host = urlparse(url).netloc
+    with _host_lock:
+        now = time.monotonic()
+        slot = max(now, _host_next_slot.get(host, 0.0))
+        _host_next_slot[host] = slot + HOST_MIN_INTERVAL
+    if slot > now:
+        time.sleep(slot - now)
+
+def _load_validators() -> dict:
+    global _validators
+    if _validators is None:
+        try:
+            with open(VALIDATOR_STORE_PATH, "r", encoding="utf-8") as f:
+                _validators = json.load(f)
+        except (OSError, ValueError):
+            _validators = {}
+    return _validators
+
+def _save_validator(url: str, response, articles: List[Dict]):
+    """Remembers the response validators and parsed articles for the next conditional GET.
+
+    Updates are kept in memory; flush_validators() writes them to disk once
+    the news stage is done.
+    """
+    global _validators_dirty
+    etag, modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    with _validators_lock:
+        validators = _load_validators()
+        if not (etag or modified):
+            if validators.pop(url, None) is None:
+                return
+        else:
+            validators[url] = {"etag": etag, "last_modified": modified, "articles": articles}
+        _validators_dirty = True
 
-def fetch_history(ticker: str, period: str = "1y") -> pd.DataFrame:
-    """Fetches historical stock data for a given ticker using yfinance."""
-    stock = yf.Ticker(ticker)
-    hist = stock.history(period=period)
+def flush_validators():
+    """Writes the validator store to disk if anything changed since the last flush."""
+    global _validators_dirty
+    with _validators_lock:
+        if not _validators_dirty:
+            return
+        try:
+            if os.path.dirname(VALIDATOR_STORE_PATH):
+                os.makedirs(os.path.dirname(VALIDATOR_STORE_PATH), exist_ok=True)
+            tmp_path = f"{VALIDATOR_STORE_PATH}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(_validators, f)
+            os.replace(tmp_path, VALIDATOR_STORE_PATH)
+            _validators_dirty = False
+        except OSError as e:
+            print(f"Could not save HTTP validators: {e}")
+
+def _fetch_articles(url: str, parse) -> List[Dict]:
+    """GETs url through the shared session and parses it into articles.
+
+    Sends If-None-Match/If-Modified-Since from the validator store; on a
+    304 the articles parsed last time are returned without downloading or
+    parsing the page again.
+    """
+    with _validators_lock:
+        known = _load_validators().get(url)
+    headers = {}
+    if known:
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+    _wait_for_host(url)
+    # Parsers read the whole body (response.content) so the connection goes back to the pool
+    metrics.count("api_calls")
+    with get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 304 and known:
+            metrics.count("cache_hits")
+            print(f"Not modified since last run, reusing {len(known['articles'])} articles: {url}")
+            return known["articles"]
+        response.raise_for_status()
+        articles = parse(response)
+        # Bytes pulled over the wire
+        metrics.count("bytes", response.raw.tell())
+    _save_validator(url, response, articles)
+    return articles
+
+def fetch_history(ticker: str, period: str = "1y", start=None, interval: str = "1d") -> pd.DataFrame:
+    """Fetches historical stock data for a given ticker using yfinance (from start when given)."""
+    stock = _yfinance().Ticker(ticker)
+    metrics.count("api_calls")
+    window = {"period": period} if start is None else {"start": start}
+    hist = stock.history(**window, interval=interval)
     if hist is None or hist.empty:
         raise ValueError(f"No data found for ticker: {ticker}")
     # Ensure index is datetime
@@ -22,6 +161,107 @@ def fetch_history(ticker: str, period: str = "1y") -> pd.DataFrame:
     print(f"Successfully fetched price history for {ticker}. Rows: {len(hist)}")
     return hist
 
+def _split_download(data: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """Splits a group_by='ticker' yf.download frame into per-ticker frames shaped like fetch_history."""
+    frames = {}
+    if data is None or data.empty:
+        return frames
+    available = set(data.columns.get_level_values(0)) if isinstance(data.columns, pd.MultiIndex) else set()
+    for ticker in tickers:
+        if ticker not in available:
+            continue
+        hist = data[ticker].dropna(how="all")
+        if hist.empty:
+            continue
+        hist = hist[[c for c in HISTORY_COLUMNS if c in hist.columns]]
+        hist.columns.name = None
+        try:
+            hist.index = pd.to_datetime(hist.index)
+        except Exception:
+            pass
+        frames[ticker] = hist
+    return frames
+
+def fetch_history_bulk(tickers: List[str], period: str = "1y", chunk_size: int = HISTORY_CHUNK_SIZE,
+                       start=None, interval: str = "1d") -> Dict[str, pd.DataFrame]:
+    """Fetches history for many tickers with one yf.download request per chunk.
+
+    Returns a dict of per-ticker DataFrames matching fetch_history. Symbols
+    from a failed chunk, or missing from a successful one, are retried one
+    by one; tickers that still have no data are left out of the result.
+    When start is given, only bars from that date onwards are requested;
+    interval selects intraday bars (e.g. "5m") instead of daily ones.
+    """
+    unique = list(dict.fromkeys(tickers))
+    chunk_size = max(1, int(chunk_size))
+    frames = {}
+    for offset in range(0, len(unique), chunk_size):
+        chunk = unique[offset:offset + chunk_size]
+        try:
+            window = {"period": period} if start is None else {"start": start}
+            metrics.count("api_calls")
+            data = _yfinance().download(chunk, **window, interval=interval, group_by="ticker", actions=True,
+                               auto_adjust=True, ignore_tz=False, threads=True, progress=False)
+            frames.update(_split_download(data, chunk))
+        except Exception as e:
+            print(f"Bulk history download failed for {len(chunk)} tickers: {e}")
+
+        for ticker in chunk:
+            if ticker in frames:
+                continue
+            try:
+                frames[ticker] = fetch_history(ticker, period=period, start=start, interval=interval)
+            except Exception as e:
+                print(f"Could not fetch price history for {ticker}: {e}")
+
+    print(f"Successfully fetched price history for {len(frames)}/{len(unique)} tickers in bulk.")
+    return frames
+
+def _parse_google_rss(stream, max_items: int) -> List[Dict]:
+    """Reads RSS items from a byte stream, stopping parsing as soon as max_items are found."""
+    articles = []
+    if max_items <= 0:
+        return articles
+    for _, item in ET.iterparse(stream, events=("end",)):
+        if item.tag != 'item':
+            continue
+        title = item.find('title').text if item.find('title') is not None else ''
+        link = item.find('link').text if item.find('link') is not None else ''
+        articles.append({
+            "title": title,
+            "link": link,
+            "source": "Google News"
+        })
+        item.clear()
+        if len(articles) >= max_items:
+            break
+    return articles
+
+# Yahoo quote pages are large; only the news list items (or h3 headings) are of interest
+_YAHOO_STREAM_ITEMS = "//li[contains(concat(' ', normalize-space(@class), ' '), ' js-stream-content ')]"
+
+def _parse_yahoo_page(content: bytes, max_items: int) -> List[Dict]:
+    import lxml.html
+    articles = []
+    doc = lxml.html.fromstring(content)
+    # Try a couple of selectors to be resilient
+    news_items = doc.xpath(_YAHOO_STREAM_ITEMS) or doc.xpath('//h3')
+    for item in news_items:
+        if len(articles) >= max_items:
+            break
+        link_tag = item.find('.//a')
+        if link_tag is not None and link_tag.get('href') is not None:
+            title = ''.join(text.strip() for text in link_tag.itertext())
+            href = link_tag.get('href')
+            if href.startswith('/'):
+                href = f"https://finance.yahoo.com{href}"
+            articles.append({
+                "title": title,
+                "link": href,
+                "source": "Yahoo Finance"
+            })
+    return articles
+
 def fetch_news(ticker: str, max_items: int = 5) -> List[Dict]:
     """Fetches news articles from Google News RSS and Yahoo Finance (best-effort)."""
     articles = []
@@ -32,44 +272,13 @@ def fetch_news(ticker: str, max_items: int = 5) -> List[Dict]:
 
     # 1. Google News RSS
     try:
-        response = requests.get(sources["google"], headers={"User-Agent": USER_AGENT}, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        for item in root.findall('.//item')[:max_items]:
-            title = item.find('title').text if item.find('title') is not None else ''
-            link = item.find('link').text if item.find('link') is not None else ''
-            articles.append({
-                "title": title,
-                "link": link,
-                "source": "Google News"
-            })
+        articles.extend(_fetch_articles(sources["google"], lambda r: _parse_google_rss(BytesIO(r.content), max_items)))
     except Exception as e:
         print(f"Could not fetch Google News for {ticker}: {e}")
 
     # 2. Yahoo Finance Scraper (best-effort)
     try:
-        headers = {"User-Agent": USER_AGENT}
-        response = requests.get(sources["yahoo"], headers=headers, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        # Try a couple of selectors to be resilient
-        news_items = soup.select('li.js-stream-content') or soup.select('h3') or []
-        count = 0
-        for item in news_items:
-            if count >= max_items:
-                break
-            link_tag = item.find('a') if hasattr(item, 'find') else None
-            if link_tag and link_tag.has_attr('href'):
-                title = link_tag.get_text(strip=True)
-                href = link_tag['href']
-                if href.startswith('/'):
-                    href = f"https://finance.yahoo.com{href}"
-                articles.append({
-                    "title": title,
-                    "link": href,
-                    "source": "Yahoo Finance"
-                })
-                count += 1
+        articles.extend(_fetch_articles(sources["yahoo"], lambda r: _parse_yahoo_page(r.content, max_items)))
     except Exception as e:
         print(f"Could not fetch Yahoo Finance news for {ticker}: {e}")
 
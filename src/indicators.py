@@ -1,9 +1,15 @@
+import copy
+import math
+import sys
+
 import pandas as pd
 import numpy as np
-import pandas_ta as ta
 
 def compute_indicators(df: pd.DataFrame) -> pd.DataFrame:
     """Computes technical indicators for the stock data."""
+    # Imported here: pandas_ta is slow to load and only this full-recompute path uses it
+    import pandas_ta as ta
+
     # Work on a copy to avoid SettingWithCopy warnings
     df = df.copy()
 
@@ -35,3 +41,278 @@ def compute_indicators(df: pd.DataFrame) -> pd.DataFrame:
     df.dropna(inplace=True)
     print(f"Successfully computed technical indicators. Rows after dropna: {len(df)}")
     return df
+
+# --- Incremental mode ---
+# Mirrors the pandas_ta defaults used above (SMA 20/50, Wilder RSI 14, MACD 12/26/9,
+# BBands 5/2.0, ATR 14 RMA, OBV) plus the 30-day volatility, one bar at a time.
+INDICATOR_STATE_VERSION = 2
+INDICATOR_COLUMNS = [
+    "SMA_20", "SMA_50", "RSI_14", "MACD_12_26_9", "MACDh_12_26_9", "MACDs_12_26_9",
+    "BBL_5_2.0", "BBM_5_2.0", "BBU_5_2.0", "BBB_5_2.0", "BBP_5_2.0", "ATRr_14", "OBV",
+    "log_return", "volatility",
+]
+
+def _ewm_step(acc: dict, x: float, alpha: float, adjust: bool) -> float:
+    """Advances a pandas-style ewm(alpha, adjust) accumulator by one observation."""
+    if acc["n"] == 0:
+        acc["mean"], acc["weight"] = x, 1.0
+    else:
+        acc["weight"] *= 1 - alpha
+        new_weight = 1.0 if adjust else alpha
+        acc["mean"] = (acc["weight"] * acc["mean"] + new_weight * x) / (acc["weight"] + new_weight)
+        acc["weight"] = acc["weight"] + new_weight if adjust else 1.0
+    acc["n"] += 1
+    return acc["mean"]
+
+def _rma_step(acc: dict, x: float, length: int) -> float:
+    """pandas_ta rma: ewm(alpha=1/length, min_periods=length) over non-missing values."""
+    value = _ewm_step(acc, x, 1.0 / length, adjust=True)
+    return value if acc["n"] >= length else np.nan
+
+def _ema_step(acc: dict, x: float, length: int) -> float:
+    """pandas_ta ema: seeded with the SMA of the first `length` values, then ewm(span, adjust=False)."""
+    if acc["n"] < length:
+        acc["seed"].append(x)
+        acc["n"] += 1
+        if acc["n"] < length:
+            return np.nan
+        acc["mean"], acc["seed"] = float(np.mean(acc["seed"])), []
+        return acc["mean"]
+    alpha = 2.0 / (length + 1)
+    acc["mean"] = (1 - alpha) * acc["mean"] + alpha * x
+    acc["n"] += 1
+    return acc["mean"]
+
+def _window_push(window: list, x: float, size: int) -> list:
+    window.append(x)
+    if len(window) > size:
+        del window[0]
+    return window
+
+def _non_zero(x: float) -> float:
+    return x if x != 0 else x + sys.float_info.epsilon
+
+def new_indicator_state() -> dict:
+    """Returns an empty, JSON-serializable indicator state."""
+    ewm = lambda: {"n": 0, "mean": 0.0, "weight": 0.0}
+    ema = lambda: {"n": 0, "mean": 0.0, "seed": []}
+    return {
+        "version": INDICATOR_STATE_VERSION,
+        "last_date": None,
+        "last_close": None,
+        "closes": [],
+        "returns": [],
+        "rsi_pos": ewm(), "rsi_neg": ewm(),
+        "ema_fast": ema(), "ema_slow": ema(), "ema_signal": ema(),
+        "atr": ewm(),
+        "obv": 0.0,
+        "obv_terms": [],
+        "last_row": None,
+    }
+
+def _trim_obv(state: dict, start: pd.Timestamp):
+    """Drops the OBV terms of bars before start, where the full recompute's cumsum begins."""
+    terms = state["obv_terms"]
+    while terms and pd.Timestamp(terms[0][0]) < start:
+        del terms[0]
+    state["obv"] = math.fsum(term[1] for term in terms)
+
+def _advance(state: dict, bar: dict, date: pd.Timestamp) -> dict:
+    """Advances the state over one bar and returns that bar's indicator values."""
+    close, high, low = float(bar["Close"]), float(bar["High"]), float(bar["Low"])
+    prev = state["last_close"]
+    closes = _window_push(state["closes"], close, 50)
+    row = {}
+
+    row["SMA_20"] = float(np.mean(closes[-20:])) if len(closes) >= 20 else np.nan
+    row["SMA_50"] = float(np.mean(closes)) if len(closes) >= 50 else np.nan
+
+    if prev is None:
+        row["RSI_14"] = row["ATRr_14"] = row["log_return"] = np.nan
+        signed_volume = float(bar["Volume"])
+    else:
+        change = close - prev
+        pos = _rma_step(state["rsi_pos"], max(change, 0.0), 14)
+        neg = _rma_step(state["rsi_neg"], min(change, 0.0), 14)
+        row["RSI_14"] = 100 * pos / (pos + abs(neg)) if (pos + abs(neg)) != 0 else np.nan
+        true_range = max(abs(_non_zero(high - low)), abs(high - prev), abs(prev - low))
+        row["ATRr_14"] = _rma_step(state["atr"], true_range, 14)
+        signed_volume = float(np.sign(change)) * float(bar["Volume"])
+        row["log_return"] = float(np.log(close) - np.log(prev))
+        _window_push(state["returns"], row["log_return"], 30)
+    # OBV is a cumsum from the window's first bar, which counts its volume unsigned
+    state["obv_terms"].append([date.isoformat(), signed_volume, float(bar["Volume"])])
+    state["obv"] += signed_volume
+    first = state["obv_terms"][0]
+    row["OBV"] = state["obv"] - first[1] + first[2]
+
+    fast = _ema_step(state["ema_fast"], close, 12)
+    slow = _ema_step(state["ema_slow"], close, 26)
+    macd = fast - slow
+    signal = _ema_step(state["ema_signal"], macd, 9) if not np.isnan(macd) else np.nan
+    row["MACD_12_26_9"], row["MACDh_12_26_9"], row["MACDs_12_26_9"] = macd, macd - signal, signal
+
+    if len(closes) >= 5:
+        window = closes[-5:]
+        mid, dev = float(np.mean(window)), 2.0 * float(np.std(window))
+        lower, upper = mid - dev, mid + dev
+        width = _non_zero(upper - lower)
+        row["BBL_5_2.0"], row["BBM_5_2.0"], row["BBU_5_2.0"] = lower, mid, upper
+        row["BBB_5_2.0"], row["BBP_5_2.0"] = 100 * width / mid, _non_zero(close - lower) / width
+    else:
+        for col in ("BBL_5_2.0", "BBM_5_2.0", "BBU_5_2.0", "BBB_5_2.0", "BBP_5_2.0"):
+            row[col] = np.nan
+
+    returns = state["returns"]
+    row["volatility"] = float(np.std(returns, ddof=1)) * (252**0.5) if len(returns) >= 30 else np.nan
+    state["last_close"] = close
+    return row
+
+def compute_indicators_incremental(df: pd.DataFrame, state: dict = None) -> tuple[pd.DataFrame, dict]:
+    """Computes indicators only for bars newer than a saved state.
+
+    Returns the new rows (warm-up rows dropped, like compute_indicators) and
+    the advanced state; the latest complete row is kept in state['last_row'].
+    The state is rebuilt from the first bar when it is missing, from another
+    version, when the bar it ended on was revised, or when df starts before
+    the bars it covers. OBV only sums the bars of df, like the full
+    recompute over the same window.
+    """
+    if 'Close' not in df.columns:
+        raise ValueError("Dataframe must contain 'Close' column")
+    state = copy.deepcopy(state) if state else None
+    if state is not None:
+        last = pd.Timestamp(state["last_date"]) if state.get("last_date") else None
+        if (state.get("version") != INDICATOR_STATE_VERSION or last is None or last not in df.index
+                or not np.isclose(float(df.loc[last, "Close"]), state["last_close"])
+                or (state["obv_terms"] and pd.Timestamp(state["obv_terms"][0][0]) > df.index[0])):
+            print("Indicator state is missing or out of date; rebuilding from full history.")
+            state = None
+    if state is None:
+        state, new_bars = new_indicator_state(), df
+    else:
+        new_bars = df[df.index > pd.Timestamp(state["last_date"])]
+        _trim_obv(state, df.index[0])
+
+    rows = []
+    for date, bar in zip(new_bars.index, new_bars.to_dict("records")):
+        bar.update(_advance(state, bar, date))
+        rows.append(bar)
+        state["last_date"] = date.isoformat()
+
+    out = pd.DataFrame(rows, index=new_bars.index, columns=list(df.columns) + INDICATOR_COLUMNS)
+    out.dropna(inplace=True)
+    if not out.empty:
+        state["last_row"] = {k: (v.item() if hasattr(v, "item") else v) for k, v in out.iloc[-1].items()}
+    print(f"Incrementally computed indicators for {len(new_bars)} new bars.")
+    return out, state
+
+# --- Panel mode ---
+PANEL_FIELDS = ["Open", "High", "Low", "Close", "Volume", "Dividends", "Stock Splits"]
+
+def to_panel(histories: dict[str, pd.DataFrame]) -> dict[str, pd.DataFrame]:
+    """Pivots per-ticker frames into wide (dates x tickers) frames, one per field."""
+    fields = [f for f in PANEL_FIELDS if all(f in h.columns for h in histories.values())]
+    return {f: pd.DataFrame({t: h[f] for t, h in histories.items()}) for f in fields}
+
+def _compact(values: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Moves each column's valid rows to the top, keeping their order (NaN below)."""
+    order = np.argsort(~valid, axis=0, kind="stable")
+    packed = np.take_along_axis(values, order, axis=0)
+    packed[np.arange(len(values))[:, None] >= valid.sum(axis=0)] = np.nan
+    return packed, order
+
+def _panel_ema(frame: pd.DataFrame, length: int) -> pd.DataFrame:
+    """pandas_ta ema on every column at once (columns must start at row 0)."""
+    if len(frame) < length:
+        # Too few bars to seed: pandas_ta leaves the whole series empty
+        return frame * np.nan
+    seeded = frame.copy()
+    seeded.iloc[:length - 1] = np.nan
+    seeded.iloc[length - 1] = frame.iloc[:length].mean()
+    return seeded.ewm(span=length, adjust=False).mean()
+
+def _panel_rma(frame: pd.DataFrame, length: int) -> pd.DataFrame:
+    return frame.ewm(alpha=1.0 / length, min_periods=length).mean()
+
+def _panel_non_zero(x: np.ndarray) -> np.ndarray:
+    return np.where(x == 0, x + sys.float_info.epsilon, x)
+
+def compute_indicators_panel(panel: dict[str, pd.DataFrame]) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
+    """Computes the compute_indicators set for a whole watchlist in one batched pass.
+
+    panel maps field names (at least High, Low, Close, Volume) to wide
+    dates x tickers frames, e.g. from to_panel(). Each ticker's bars are
+    compacted so gaps and different listing dates give the same result as
+    running compute_indicators on that ticker alone. Returns per-ticker
+    frames (warm-up rows dropped) and a table of each ticker's latest row.
+    """
+    if all(wide.shape[1] == 0 for wide in panel.values()):
+        # No tickers (e.g. every history fetch failed)
+        return {}, pd.DataFrame(columns=list(panel) + INDICATOR_COLUMNS)
+    for field in ("High", "Low", "Close", "Volume"):
+        if field not in panel:
+            raise ValueError(f"Panel must contain '{field}'")
+    close_wide = panel["Close"]
+    dates, tickers = close_wide.index, close_wide.columns
+    valid = close_wide.notna().to_numpy()
+
+    packed, order = {}, None
+    for field, wide in panel.items():
+        values = wide.reindex(index=dates, columns=tickers).to_numpy(dtype=float)
+        packed[field], order = _compact(values, valid)
+    frame = lambda arr: pd.DataFrame(arr, columns=tickers)
+    close, high, low, volume = (frame(packed[f]) for f in ("Close", "High", "Low", "Volume"))
+
+    out = {}
+    out["SMA_20"] = close.rolling(20).mean()
+    out["SMA_50"] = close.rolling(50).mean()
+
+    change = close.diff()
+    pos, neg = _panel_rma(change.clip(lower=0), 14), _panel_rma(change.clip(upper=0), 14)
+    out["RSI_14"] = 100 * pos / (pos + neg.abs())
+
+    macd = _panel_ema(close, 12) - _panel_ema(close, 26)
+    signal = _panel_ema(macd.iloc[25:].reset_index(drop=True), 9)
+    signal.index = macd.index[25:]
+    signal = signal.reindex(macd.index)
+    out["MACD_12_26_9"], out["MACDh_12_26_9"], out["MACDs_12_26_9"] = macd, macd - signal, signal
+
+    mid, dev = close.rolling(5).mean(), 2.0 * close.rolling(5).std(ddof=0)
+    lower, upper = mid - dev, mid + dev
+    width = _panel_non_zero((upper - lower).to_numpy())
+    out["BBL_5_2.0"], out["BBM_5_2.0"], out["BBU_5_2.0"] = lower, mid, upper
+    out["BBB_5_2.0"] = 100 * width / mid
+    out["BBP_5_2.0"] = _panel_non_zero((close - lower).to_numpy()) / width
+
+    prev = close.shift(1).to_numpy()
+    hl = np.abs(_panel_non_zero((high - low).to_numpy()))
+    true_range = np.fmax(hl, np.fmax(np.abs(high.to_numpy() - prev), np.abs(prev - low.to_numpy())))
+    true_range[0] = np.nan
+    out["ATRr_14"] = _panel_rma(frame(true_range), 14)
+
+    sign = np.sign(change.to_numpy())
+    sign[0] = 1
+    out["OBV"] = frame(sign * volume.to_numpy()).cumsum()
+
+    log_close = np.log(close)
+    out["log_return"] = log_close - log_close.shift(1)
+    out["volatility"] = out["log_return"].rolling(window=30).std() * (252**0.5)
+
+    # Scatter the compacted results back to their original dates
+    columns = list(panel) + INDICATOR_COLUMNS
+    stacked = np.empty((len(columns), len(dates), len(tickers)))
+    for i, name in enumerate(columns):
+        values = packed[name] if name in packed else np.asarray(out[name], dtype=float)
+        np.put_along_axis(stacked[i], order, values, axis=0)
+
+    frames, latest = {}, {}
+    for j, ticker in enumerate(tickers):
+        df = pd.DataFrame(stacked[:, valid[:, j], j].T, index=dates[valid[:, j]], columns=columns)
+        df.dropna(inplace=True)
+        frames[ticker] = df
+        if not df.empty:
+            latest[ticker] = df.iloc[-1]
+    summary = pd.DataFrame.from_dict(latest, orient="index", columns=columns)
+    print(f"Successfully computed panel indicators for {len(tickers)} tickers.")
+    return frames, summary
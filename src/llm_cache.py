@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Completions are cached on disk keyed by a hash of (model, system prompt, user content).
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "1").strip().lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join("data", "llm_cache.sqlite"))
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 3 * 24 * 3600))
+# Least recently used entries beyond this count are evicted
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 5000))
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+# groq.Groq once imported (None when the library is missing); loaded by the first client
+_groq_class = ...
+# One client per API key, shared by every stage (and every cycle of the daemon)
+_clients = {}
+
+class LLMBudgetExceeded(Exception):
+    """Raised instead of calling the API once a run's request or token budget is spent."""
+
+def new_budget(max_requests: int = 0, max_tokens: int = 0) -> dict:
+    """Returns a per-run API budget shared across threads (0 means unlimited)."""
+    return {"max_requests": max_requests, "max_tokens": max_tokens, "requests": 0, "tokens": 0,
+            "lock": threading.Lock()}
+
+def _reserve(budget: dict, estimate: int):
+    with budget["lock"]:
+        if budget["max_requests"] and budget["requests"] >= budget["max_requests"]:
+            raise LLMBudgetExceeded(f"request budget of {budget['max_requests']} used up")
+        if budget["max_tokens"] and budget["tokens"] + estimate > budget["max_tokens"]:
+            raise LLMBudgetExceeded(f"token budget of {budget['max_tokens']} used up")
+        budget["requests"] += 1
+        budget["tokens"] += estimate
+
+def groq_class():
+    """Imports and returns groq.Groq on first use, or None when groq is not installed."""
+    global _groq_class
+    if _groq_class is ...:
+        try:
+            from groq import Groq
+        except Exception:
+            Groq = None
+        _groq_class = Groq
+    return _groq_class
+
+def get_client():
+    """Returns the shared Groq client for GROQ_API_KEY, or None without a key or the groq library.
+
+    groq is only imported when a key is set, so runs without one never load it.
+    The client (and its connection pool) is created once and reused.
+    """
+    groq_key = os.environ.get("GROQ_API_KEY")
+    if not groq_key:
+        return None
+    client_class = groq_class()
+    if client_class is None:
+        return None
+    with _lock:
+        if groq_key not in _clients:
+            _clients[groq_key] = client_class(api_key=groq_key)
+        return _clients[groq_key]
+
+def _connect() -> sqlite3.Connection:
+    if os.path.dirname(LLM_CACHE_PATH):
+        os.makedirs(os.path.dirname(LLM_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created_at REAL, last_used REAL)")
+    return conn
+
+def cache_key(model: str, system_prompt: str, user_content: str) -> str:
+    """Returns the content address of a completion request."""
+    payload = json.dumps([model, system_prompt, user_content], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_cached(key: str):
+    """Returns the cached response for key, or None when missing or older than the TTL."""
+    with _lock:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[1] > LLM_CACHE_TTL:
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return row[0]
+        finally:
+            conn.close()
+
+def put_cached(key: str, response: str):
+    """Stores a response and evicts expired and least recently used entries."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                         (key, response, now, now))
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - LLM_CACHE_TTL,))
+            conn.execute("DELETE FROM responses WHERE key NOT IN "
+                         "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)", (LLM_CACHE_MAX_ENTRIES,))
+            conn.commit()
+        finally:
+            conn.close()
+
+def cached_completion(client, model: str, system_prompt: str, user_content: str, budget: dict = None) -> str:
+    """Returns a chat completion's content, calling the API only on a cache miss.
+
+    API errors propagate to the caller; cache read/write errors are reported
+    and the request simply goes through uncached. With a budget (new_budget),
+    a miss that would exceed it raises LLMBudgetExceeded instead; tokens are
+    reserved from a rough prompt-size estimate and settled from the usage
+    the API reports.
+    """
+    key = cache_key(model, system_prompt, user_content)
+    if LLM_CACHE_ENABLED:
+        try:
+            cached = get_cached(key)
+        except Exception as e:
+            print(f"LLM cache read failed: {e}")
+            cached = None
+        with _lock:
+            _stats["hits" if cached is not None else "misses"] += 1
+        if cached is not None:
+            metrics.count("cache_hits")
+            return cached
+
+    # ~4 characters per token for the prompt, plus room for a paragraph-sized answer
+    estimate = (len(system_prompt) + len(user_content)) // 4 + 256
+    if budget is not None:
+        _reserve(budget, estimate)
+    metrics.count("api_calls")
+    chat_completion = client.chat.completions.create(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ],
+        model=model,
+    )
+    used = getattr(getattr(chat_completion, "usage", None), "total_tokens", None)
+    if budget is not None and isinstance(used, int):
+        with budget["lock"]:
+            budget["tokens"] += used - estimate
+    response = chat_completion.choices[0].message.content
+    if LLM_CACHE_ENABLED and response is not None:
+        try:
+            put_cached(key, response)
+        except Exception as e:
+            print(f"LLM cache write failed: {e}")
+    return response
+
+def cache_stats() -> dict:
+    """Returns hit/miss counts and the hit rate for this process."""
+    lookups = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": _stats["hits"] / lookups if lookups else 0.0}
@@ -1,10 +1,123 @@
 import smtplib
 import os
+from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-def send_email(subject: str, html_content: str, to_email: str):
-    """Sends an email with HTML content via SMTP (Gmail recommended using App Password)."""
+import metrics
+
+# Gmail over implicit TLS by default; SMTP_SSL=0 connects in plain text and upgrades
+# with STARTTLS when the server offers it (e.g. a local relay or test sink)
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 465))
+SMTP_SSL = os.environ.get("SMTP_SSL", "1").strip().lower() in ("1", "true", "yes")
+
+def _connect() -> smtplib.SMTP:
+    if SMTP_SSL:
+        return smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=30)
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+    server.ehlo()
+    if server.has_extn("starttls"):
+        server.starttls()
+        server.ehlo()
+    return server
+
+def build_message(subject: str, html_content: str, sender: str, to_emails: list[str],
+                  inline_images: list[dict] = None) -> MIMEMultipart:
+    """Builds the HTML message, with inline_images (from write_html_report's 'cid' mode) as related parts."""
+    msg = MIMEMultipart('related' if inline_images else 'alternative')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = ", ".join(to_emails)
+
+    msg.attach(MIMEText(html_content, 'html'))
+    for image in inline_images or []:
+        part = MIMEImage(image['data'], _subtype=image['mime'].split('/', 1)[1])
+        part.add_header('Content-ID', f"<{image['cid']}>")
+        part.add_header('Content-Disposition', 'inline', filename=image.get('filename', image['cid']))
+        msg.attach(part)
+    return msg
+
+def _dropped(error: Exception) -> bool:
+    """True when the server closed or lost the connection, so reconnecting may help."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError))
+
+class SMTPConnection:
+    """One authenticated SMTP connection reused for many messages; use as a context manager.
+
+    The connection is opened and logged in on the first send. When the
+    server drops it (idle timeout, 421, reset), it is re-opened and the
+    message is retried once.
+    """
+
+    def __init__(self, user: str = None, password: str = None):
+        self.user = user or os.environ.get("EMAIL_USER")
+        self.password = password or os.environ.get("EMAIL_PASS")
+        self.server = None
+        self.connects = 0
+
+    def _open(self):
+        server = _connect()
+        try:
+            server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.connects += 1
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+    def send(self, msg: MIMEMultipart, to_emails: list[str]):
+        """Sends msg to every address in to_emails in one transaction."""
+        message = msg.as_string()
+        for attempt in range(2):
+            try:
+                if self.server is None:
+                    self._open()
+                self.server.sendmail(self.user, to_emails, message)
+                break
+            except Exception as e:
+                if not _dropped(e):
+                    raise
+                self.server = None
+                if attempt:
+                    raise
+                print(f"SMTP connection dropped ({e}); reconnecting.")
+        metrics.count("api_calls")
+        metrics.count("bytes", len(message))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _save_fallback(html_content: str, name: str = "stock_report_failed_email.html"):
+    """Saves a report that could not be sent so it can be delivered by hand."""
+    try:
+        os.makedirs('report', exist_ok=True)
+        fallback_path = os.path.join('report', name)
+        with open(fallback_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        print(f"Saved HTML report to {fallback_path} for manual delivery.")
+    except Exception as ex:
+        print(f"Also failed to save HTML report: {ex}")
+
+def send_email(subject: str, html_content: str, to_email: str, inline_images: list[dict] = None):
+    """Sends an email with HTML content via SMTP (Gmail recommended using App Password).
+
+    inline_images are the attachments returned by utils.write_html_report in
+    'cid' mode; they are embedded as related parts the HTML refers to by cid.
+    """
     email_user = os.environ.get("EMAIL_USER")
     email_pass = os.environ.get("EMAIL_PASS")
 
@@ -12,27 +125,41 @@ def send_email(subject: str, html_content: str, to_email: str):
         print("Email credentials or recipient not set. Skipping email.")
         return
 
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = subject
-    msg['From'] = email_user
-    msg['To'] = to_email
-
-    msg.attach(MIMEText(html_content, 'html'))
-
     try:
-        # Gmail SSL
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=30) as smtp_server:
-            smtp_server.login(email_user, email_pass)
-            smtp_server.sendmail(email_user, [to_email], msg.as_string())
+        with SMTPConnection(email_user, email_pass) as connection:
+            connection.send(build_message(subject, html_content, email_user, [to_email], inline_images), [to_email])
         print(f"Email sent successfully to {to_email}.")
     except Exception as e:
         print(f"Failed to send email: {e}")
         # Save the report locally as a fallback
-        try:
-            os.makedirs('report', exist_ok=True)
-            fallback_path = os.path.join('report', 'stock_report_failed_email.html')
-            with open(fallback_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            print(f"Saved HTML report to {fallback_path} for manual delivery.")
-        except Exception as ex:
-            print(f"Also failed to save HTML report: {ex}")
+        _save_fallback(html_content)
+
+def send_emails(messages: list[dict]) -> int:
+    """Sends many messages over one pooled SMTP connection and returns how many were delivered.
+
+    Each message is a dict with 'subject', 'html_content', 'to' (an address
+    or a list, all sent in one transaction) and optionally 'inline_images'.
+    A message that fails is reported and saved to report/ like send_email's
+    fallback; the others are still sent.
+    """
+    email_user = os.environ.get("EMAIL_USER")
+    email_pass = os.environ.get("EMAIL_PASS")
+    if not all([email_user, email_pass]):
+        print("Email credentials not set. Skipping email.")
+        return 0
+
+    delivered = 0
+    with SMTPConnection(email_user, email_pass) as connection:
+        for i, message in enumerate(messages):
+            to_emails = [message['to']] if isinstance(message['to'], str) else list(message['to'])
+            try:
+                msg = build_message(message['subject'], message['html_content'], email_user, to_emails,
+                                    message.get('inline_images'))
+                connection.send(msg, to_emails)
+                delivered += 1
+            except Exception as e:
+                print(f"Failed to send email to {', '.join(to_emails)}: {e}")
+                name = "stock_report_failed_email.html" if len(messages) == 1 else f"stock_report_failed_email_{i + 1}.html"
+                _save_fallback(message['html_content'], name)
+    print(f"Sent {delivered}/{len(messages)} emails over {connection.connects} SMTP connection(s).")
+    return delivered
@@ -1,14 +1,23 @@
+import argparse
+import json
 import os
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
 
-from fetchers import fetch_history, fetch_news
-from indicators import compute_indicators
+from fetchers import fetch_history, fetch_history_bulk, fetch_news, flush_validators
+from indicators import compute_indicators, compute_indicators_incremental, compute_indicators_panel, to_panel
+from price_store import load_indicator_state, refresh_histories, save_indicator_state
 from summarizer import process_articles
-from controller import run_controller
-from utils import generate_chart, render_html_report
-from mailer import send_email
+from controller import decide_actions, rule_frame, run_controller_batch
+from llm_cache import cache_stats
+from news_index import process_articles_once
+from utils import CHART_BARS, init_chart_worker, render_chart, write_html_report
+from mailer import send_emails
+import metrics
 
 # --- Configuration ---
 # For local testing, create a .env file with your secrets
@@ -24,67 +33,322 @@ TICKERS = os.environ.get('TICKERS', 'AMD,AVGO').split(',')
 TICKERS = [t.strip().upper() for t in TICKERS if t.strip()]
 RECIPIENT_EMAIL = os.environ.get("RECIPIENT_EMAIL") or os.environ.get("EMAIL_USER")
 
+# Concurrent mode runs each pipeline stage for all tickers on a bounded pool.
+# Network stages (yfinance, RSS, Groq) use threads; CPU stages use processes.
+RUN_CONCURRENT = os.environ.get('RUN_CONCURRENT', '0').strip().lower() in ('1', 'true', 'yes')
+STAGE_LIMITS = {
+    'history': int(os.environ.get('HISTORY_WORKERS', 8)),
+    'news': int(os.environ.get('NEWS_WORKERS', 8)),
+    'indicators': int(os.environ.get('INDICATOR_WORKERS', os.cpu_count() or 2)),
+    'summaries': int(os.environ.get('SUMMARY_WORKERS', 4)),
+    'controller': int(os.environ.get('CONTROLLER_WORKERS', 4)),
+    'chart': int(os.environ.get('CHART_WORKERS', os.cpu_count() or 2)),
+}
+CPU_STAGES = {'indicators', 'chart'}
+STAGE_INITIALIZERS = {'chart': init_chart_worker}
+
+# 'full' draws candlestick charts for every ticker, 'escalate' only for ESCALATE tickers
+# (the rest get a cheap SVG sparkline), 'sparkline' uses sparklines everywhere and 'none'
+# skips the chart stage (matplotlib is then never imported)
+CHART_MODE = os.environ.get('CHART_MODE', 'full').strip().lower()
+# Write the report but do not send it
+DRY_RUN = os.environ.get('DRY_RUN', '0').strip().lower() in ('1', 'true', 'yes')
+
+# The price store keeps bars on disk and only downloads what changed since the last run
+PRICE_STORE = os.environ.get('PRICE_STORE', '1').strip().lower() in ('1', 'true', 'yes')
+# How indicators are computed: 'full' (pandas_ta per ticker), 'incremental' (advance saved
+# state over new bars only) or 'panel' (one batched pass over all tickers)
+INDICATOR_MODE = os.environ.get('INDICATOR_MODE', 'full').strip().lower()
+# Deduplicate news across tickers (and past runs) so each article is processed once
+NEWS_DEDUP = os.environ.get('NEWS_DEDUP', '1').strip().lower() in ('1', 'true', 'yes')
+# 'inline' embeds charts as base64 in both the saved report and the email. Any other value
+# writes them to report/charts/ next to the saved report; 'cid' also attaches them to the
+# email as inline MIME parts instead of inlining base64.
+REPORT_CHARTS = os.environ.get('REPORT_CHARTS', 'inline').strip().lower()
+# Email only the ESCALATE tickers (the saved report always has every ticker)
+REPORT_DIGEST = os.environ.get('REPORT_DIGEST', '0').strip().lower() in ('1', 'true', 'yes')
+# JSON file of per-team reports: [{"to": address or list, "tickers": [...], "digest": bool, "name": str}].
+# Each entry gets its own report filtered from this run's results (every ticker when "tickers"
+# is omitted), all sent over one SMTP connection. Without it one report goes to RECIPIENT_EMAIL.
+REPORT_RECIPIENTS = os.environ.get('REPORT_RECIPIENTS', '').strip()
+# Bulk mode downloads price history in chunks of HISTORY_CHUNK_SIZE symbols per request
+BULK_HISTORY = os.environ.get('BULK_HISTORY', '1').strip().lower() in ('1', 'true', 'yes')
+HISTORY_CHUNK_SIZE = int(os.environ.get('HISTORY_CHUNK_SIZE', 50))
+
+@contextmanager
+def _stage_executor(stage: str):
+    """Yields a pool sized for the stage, or None to run the stage inline."""
+    if not RUN_CONCURRENT or stage not in STAGE_LIMITS:
+        yield None
+        return
+    workers = max(1, STAGE_LIMITS.get(stage, 1))
+    if stage in CPU_STAGES:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=STAGE_INITIALIZERS.get(stage))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        yield executor
+
+def _run_stage(states: list[dict], stage: str | None, key: str, fn, args):
+    """Runs fn for every ticker that has not failed yet and stores the result under key.
+
+    Exceptions are recorded on the ticker's state so one bad symbol never
+    aborts the others, and results are written back in watchlist order.
+    Named stages also record per-ticker metrics, measured in the worker.
+    """
+    pending = [s for s in states if 'error' not in s]
+    with _stage_executor(stage) as executor:
+        if executor is None:
+            jobs = [(s, None) for s in pending]
+        else:
+            jobs = [(s, executor.submit(metrics.call_tracked, fn, *args(s))) for s in pending]
+        for state, future in jobs:
+            try:
+                if stage is None:
+                    state[key] = fn(*args(state))
+                    continue
+                result, record = metrics.call_tracked(fn, *args(state)) if future is None else future.result()
+                metrics.merge(stage, state['ticker'], record)
+                state[key] = result
+            except Exception as e:
+                logging.exception(f"Failed to process {state['ticker']}: {e}")
+                state['error'] = str(e)
+
+def _pick_history(histories: dict, ticker: str):
+    """Returns a ticker's frame from a bulk download, failing like fetch_history when absent."""
+    if ticker not in histories:
+        raise ValueError(f"No data found for ticker: {ticker}")
+    return histories[ticker]
+
+def _chart_kind(controller_output: dict) -> str:
+    """Picks the renderer for a ticker according to CHART_MODE."""
+    if CHART_MODE == 'sparkline':
+        return 'sparkline'
+    if CHART_MODE == 'escalate' and controller_output.get('action') != 'ESCALATE':
+        return 'sparkline'
+    return 'candle'
+
+def _tech_summary(hist_with_indicators) -> dict:
+    """Returns the latest indicator row, failing when warm-up left no rows."""
+    if hist_with_indicators.empty:
+        raise ValueError("No data after computing indicators.")
+    return hist_with_indicators.iloc[-1].to_dict()
+
+def _incremental_tech_summary(ticker: str, hist) -> dict:
+    """Advances a ticker's saved indicator state over its new bars and returns the latest row."""
+    state = load_indicator_state(ticker)
+    if state is not None:
+        metrics.count('cache_hits')
+    _, state = compute_indicators_incremental(hist, state)
+    save_indicator_state(ticker, state)
+    if not state.get('last_row'):
+        raise ValueError("No data after computing indicators.")
+    return state['last_row']
+
+def _load_recipients() -> list[dict]:
+    """Returns the report recipients from REPORT_RECIPIENTS, or RECIPIENT_EMAIL alone."""
+    default = [{'to': RECIPIENT_EMAIL}] if RECIPIENT_EMAIL else []
+    if not REPORT_RECIPIENTS:
+        return default
+    try:
+        with open(REPORT_RECIPIENTS, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            if not entry.get('to'):
+                raise ValueError(f"recipient entry without 'to': {entry}")
+        return entries
+    except Exception as e:
+        logging.exception(f"Could not load REPORT_RECIPIENTS, sending to RECIPIENT_EMAIL only: {e}")
+        return default
+
+def _email_messages(all_ticker_data: list[dict], recipients: list[dict], report_path: str, today_date: str) -> list[dict]:
+    """Renders each recipient's report from the shared per-ticker results.
+
+    Recipients asking for the same tickers and digest setting share one
+    rendering; the full inline report is read back from report_path.
+    """
+    email_charts = 'cid' if REPORT_CHARTS == 'cid' else 'inline'
+    by_ticker = {data['ticker']: data for data in all_ticker_data}
+    rendered, messages = {}, []
+    for entry in recipients:
+        digest = entry.get('digest', REPORT_DIGEST)
+        tickers = [t.strip().upper() for t in entry['tickers']] if entry.get('tickers') else list(by_ticker)
+        missing = [t for t in tickers if t not in by_ticker]
+        if missing:
+            logging.warning(f"Not in the watchlist, left out of the report for {entry['to']}: {', '.join(missing)}")
+        key = (tuple(t for t in tickers if t in by_ticker), digest)
+        if key not in rendered:
+            if REPORT_CHARTS == 'inline' and not digest and list(key[0]) == list(by_ticker):
+                with open(report_path, "r", encoding="utf-8") as f:
+                    rendered[key] = (f.read(), [])
+            else:
+                buf = StringIO()
+                inline_images = write_html_report([by_ticker[t] for t in key[0]], buf, chart_mode=email_charts, digest=digest)
+                rendered[key] = (buf.getvalue(), inline_images)
+        html, inline_images = rendered[key]
+        name = f" ({entry['name']})" if entry.get('name') else ""
+        messages.append({
+            'subject': f"Stock Watcher {'Digest' if digest else 'Daily Report'}{name} - {today_date}",
+            'html_content': html,
+            'to': entry['to'],
+            'inline_images': inline_images,
+        })
+    return messages
+
 def run():
     """Main function to run the stock agent."""
     logging.info("🚀 Starting the stock watcher agent...")
-    all_ticker_data = []
+    metrics.reset()
+    mode = "concurrent" if RUN_CONCURRENT else "sequential"
+    logging.info(f"Processing {len(TICKERS)} tickers ({mode} mode)...")
+    states = [{'ticker': ticker} for ticker in TICKERS]
 
-    for ticker in TICKERS:
-        logging.info(f"Processing ticker: {ticker}...")
-        try:
-            # 1. Fetch data
-            hist_df = fetch_history(ticker)
-            articles = fetch_news(ticker)
+    # 1. Fetch data
+    with metrics.track('history'):
+        if PRICE_STORE or BULK_HISTORY:
+            tickers = [s['ticker'] for s in states]
+            if PRICE_STORE:
+                histories = refresh_histories(tickers, chunk_size=HISTORY_CHUNK_SIZE)
+            else:
+                histories = fetch_history_bulk(tickers, chunk_size=HISTORY_CHUNK_SIZE)
+            _run_stage(states, None, 'hist', _pick_history, lambda s: (histories, s['ticker']))
+        else:
+            _run_stage(states, 'history', 'hist', fetch_history, lambda s: (s['ticker'],))
+    with metrics.track('news'):
+        _run_stage(states, 'news', 'articles', fetch_news, lambda s: (s['ticker'],))
+        flush_validators()
 
-            # 2. Compute & Analyze
-            hist_with_indicators = compute_indicators(hist_df)
-            if hist_with_indicators.empty:
-                raise ValueError("No data after computing indicators.")
-            tech_summary = hist_with_indicators.iloc[-1].to_dict()
-            processed_news = process_articles(articles)
+    # 2. Compute & Analyze
+    with metrics.track('indicators'):
+        if INDICATOR_MODE == 'incremental':
+            # Charts only need the raw bars, so the full indicator frame is never built
+            _run_stage(states, 'indicators', 'tech', _incremental_tech_summary, lambda s: (s['ticker'], s['hist']))
+            _run_stage(states, None, 'hist_with_indicators', lambda hist: hist, lambda s: (s['hist'],))
+        elif INDICATOR_MODE == 'panel':
+            pending = [s for s in states if 'error' not in s]
+            try:
+                frames, _ = compute_indicators_panel(to_panel({s['ticker']: s['hist'] for s in pending}))
+            except Exception as e:
+                # One batched pass covers every ticker, so a failure marks them all
+                logging.exception(f"Panel indicator computation failed: {e}")
+                frames = {}
+                for state in pending:
+                    state['error'] = str(e)
+            _run_stage(states, None, 'hist_with_indicators', lambda t: frames[t], lambda s: (s['ticker'],))
+            _run_stage(states, None, 'tech', _tech_summary, lambda s: (s['hist_with_indicators'],))
+        else:
+            _run_stage(states, 'indicators', 'hist_with_indicators', compute_indicators, lambda s: (s['hist'],))
+            _run_stage(states, None, 'tech', _tech_summary, lambda s: (s['hist_with_indicators'],))
+    with metrics.track('summaries'):
+        news_by_ticker = None
+        if NEWS_DEDUP:
+            pending = [s for s in states if 'error' not in s]
+            try:
+                with _stage_executor('summaries') as executor:
+                    news_by_ticker = process_articles_once({s['ticker']: s['articles'] for s in pending},
+                                                           process_articles, executor, STAGE_LIMITS['summaries'])
+            except Exception as e:
+                logging.exception(f"Shared article processing failed, processing per ticker: {e}")
+        if news_by_ticker is not None:
+            _run_stage(states, None, 'news', lambda t: news_by_ticker[t], lambda s: (s['ticker'],))
+        else:
+            _run_stage(states, 'summaries', 'news', process_articles, lambda s: (s['articles'],))
 
-            # 3. Agentic Controller
-            controller_output = run_controller(ticker, tech_summary, processed_news)
+    # 3. Agentic Controller
+    # Rules are evaluated for the whole watchlist in one vectorized pass
+    with metrics.track('controller'):
+        pending = [s for s in states if 'error' not in s]
+        try:
+            decisions = decide_actions(rule_frame({i: s['tech'] for i, s in enumerate(pending)},
+                                                  {i: s['news'] for i, s in enumerate(pending)}))
+            items = [{'ticker': s['ticker'], 'tech': s['tech'], 'news': s['news'], 'score': int(decisions.at[i, 'score']),
+                      'decision': (decisions.at[i, 'action'], decisions.at[i, 'reason'])} for i, s in enumerate(pending)]
+            # Analyst calls share one client and run concurrently inside the batch
+            workers = STAGE_LIMITS['controller'] if RUN_CONCURRENT else 1
+            outputs = run_controller_batch(items, workers=workers)
+        except Exception as e:
+            # The batch covers every ticker, so a failure marks them all; the report still goes out
+            logging.exception(f"Controller batch failed: {e}")
+            outputs = []
+            for state in pending:
+                state['error'] = str(e)
+        for state, output in zip(pending, outputs):
+            state['controller_output'] = output
 
-            # 4. Generate Visuals
-            chart_base64 = generate_chart(hist_with_indicators, ticker)
+    # 4. Generate Visuals
+    # Only the bars that are drawn are shipped to the chart workers
+    if CHART_MODE == 'none':
+        _run_stage(states, None, 'chart', lambda: (None, None), lambda s: ())
+    else:
+        with metrics.track('chart'):
+            _run_stage(states, 'chart', 'chart', render_chart,
+                       lambda s: (s['hist_with_indicators'].tail(CHART_BARS), s['ticker'], _chart_kind(s['controller_output'])))
 
+    all_ticker_data = []
+    for state in states:
+        if 'error' in state:
+            all_ticker_data.append({'ticker': state['ticker'], 'error': state['error']})
+        else:
             all_ticker_data.append({
-                'ticker': ticker,
-                'tech': tech_summary,
-                'news': processed_news,
-                'chart': chart_base64,
-                'controller_output': controller_output
+                'ticker': state['ticker'],
+                'tech': state['tech'],
+                'news': state['news'],
+                'chart': state['chart'][0],
+                'chart_mime': state['chart'][1],
+                'controller_output': state['controller_output']
             })
 
-        except Exception as e:
-            logging.exception(f"Failed to process {ticker}: {e}")
-            # Optionally, you can add this error to the report
-            all_ticker_data.append({'ticker': ticker, 'error': str(e)})
-
     # 5. Render and Send Report
     if all_ticker_data:
-        report_html = render_html_report(all_ticker_data)
-
         # Save report to a file (useful for GitHub Actions artifact)
         os.makedirs("report", exist_ok=True)
         report_path = "report/stock_report.html"
-        with open(report_path, "w", encoding="utf-8") as f:
-            f.write(report_html)
+        file_charts = 'inline' if REPORT_CHARTS == 'inline' else 'files'
+        with metrics.track('report'), open(report_path, "w", encoding="utf-8") as f:
+            write_html_report(all_ticker_data, f, chart_mode=file_charts, asset_dir=os.path.join("report", "charts"))
         logging.info(f"HTML report saved to {report_path}")
 
-        # Send the email if recipient is configured
+        # Send the emails if recipients are configured
         today_date = datetime.now().strftime('%Y-%m-%d')
-        if RECIPIENT_EMAIL:
-            send_email(
-                subject=f"Stock Watcher Daily Report - {today_date}",
-                html_content=report_html,
-                to_email=RECIPIENT_EMAIL
-            )
+        recipients = _load_recipients()
+        if DRY_RUN:
+            logging.info("Dry run; skipping send_email.")
+        elif recipients:
+            with metrics.track('report'):
+                messages = _email_messages(all_ticker_data, recipients, report_path, today_date)
+            with metrics.track('email'):
+                send_emails(messages)
         else:
             logging.warning("No recipient email configured; skipping send_email.")
 
+    stats = cache_stats()
+    if stats['hits'] or stats['misses']:
+        logging.info(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+                     f"({stats['hit_rate']:.0%} hit rate).")
+    metrics.log_summary()
+    logging.info(f"Stage metrics saved to {metrics.write_metrics('report')}")
+
     logging.info("\n✅ Stock watcher agent finished.")
 
+def cli(argv: list[str] = None):
+    """Command-line entry point; the flags override the matching environment settings."""
+    global CHART_MODE, DRY_RUN
+    parser = argparse.ArgumentParser(description="Runs the stock watcher agent once (or continuously with --daemon).")
+    parser.add_argument('--no-charts', action='store_true', help="skip chart rendering (same as CHART_MODE=none)")
+    parser.add_argument('--dry-run', action='store_true', help="write the report without sending email (DRY_RUN=1)")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running, re-evaluate tickers as prices and news change and email escalation alerts")
+    args = parser.parse_args(argv)
+    if args.no_charts:
+        CHART_MODE = 'none'
+    if args.dry_run:
+        DRY_RUN = True
+    if args.daemon:
+        import daemon
+        daemon.run_forever(TICKERS, RECIPIENT_EMAIL, workers=STAGE_LIMITS['news'], dry_run=DRY_RUN)
+        return
+    with metrics.profiled():
+        run()
+
 if __name__ == '__main__':
-    run()
+    cli()
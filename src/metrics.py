@@ -0,0 +1,160 @@
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage and per-ticker counters collected during a run and written next to the report.
+COUNTERS = ("bytes", "api_calls", "cache_hits")
+FIELDS = ("calls", "wall_s", "cpu_s") + COUNTERS
+# 'cprofile' dumps report/profile.prof, 'pyinstrument' writes report/profile.html (if installed)
+PROFILE = os.environ.get("PROFILE", "").strip().lower()
+
+_lock = threading.Lock()
+_local = threading.local()
+_records = {}
+
+def reset():
+    """Drops everything recorded so far (called at the start of each run)."""
+    with _lock:
+        _records.clear()
+
+def count(field: str, n: int = 1):
+    """Adds n to a counter of the stage currently measured on this thread, if any."""
+    current = getattr(_local, "current", None)
+    if current is not None:
+        current[field] += n
+
+def merge(stage: str, ticker: str, record: dict):
+    """Adds a measured record to the stage/ticker totals.
+
+    Records measured in a worker process also add their CPU time to the
+    stage total, which otherwise only covers this process.
+    """
+    with _lock:
+        totals = _records.setdefault((stage, ticker or ""), dict.fromkeys(FIELDS, 0))
+        for field in FIELDS:
+            totals[field] += record.get(field, 0)
+        if ticker and record.get("pid", os.getpid()) != os.getpid():
+            _records.setdefault((stage, ""), dict.fromkeys(FIELDS, 0))["cpu_s"] += record.get("cpu_s", 0)
+
+@contextmanager
+def _measure(whole_process: bool):
+    record = dict.fromkeys(COUNTERS, 0)
+    outer, _local.current = getattr(_local, "current", None), record
+    cpu_clock = time.process_time if whole_process else time.thread_time
+    wall, cpu = time.perf_counter(), cpu_clock()
+    try:
+        yield record
+    finally:
+        _local.current = outer
+        record.update(calls=1, wall_s=time.perf_counter() - wall, cpu_s=cpu_clock() - cpu, pid=os.getpid())
+
+@contextmanager
+def track(stage: str, ticker: str = None):
+    """Measures a block as one call of stage (for ticker).
+
+    Stage totals (no ticker) use the CPU time of the whole process, so
+    worker threads are included; per-ticker records use the thread's.
+    """
+    try:
+        with _measure(whole_process=ticker is None) as record:
+            yield record
+    finally:
+        merge(stage, ticker, record)
+
+def call_tracked(fn, *args):
+    """Runs fn(*args) and returns (result, record) so pool workers can report back via merge."""
+    with _measure(whole_process=False) as record:
+        result = fn(*args)
+    return result, record
+
+def stage_rows() -> list[dict]:
+    """Returns one row per stage: its own wall/CPU time and counters summed over its tickers."""
+    with _lock:
+        stages = {}
+        for (stage, ticker), record in _records.items():
+            row = stages.setdefault(stage, {"stage": stage, "tickers": 0, **dict.fromkeys(FIELDS, 0)})
+            if ticker:
+                row["tickers"] += 1
+            else:
+                row.update(calls=record["calls"], wall_s=record["wall_s"], cpu_s=record["cpu_s"])
+            for field in COUNTERS:
+                row[field] += record[field]
+        for (stage, ticker), record in _records.items():
+            # Stages only measured per ticker (no stage-level block) sum their tickers
+            if ticker and (stage, "") not in _records:
+                for field in ("calls", "wall_s", "cpu_s"):
+                    stages[stage][field] += record[field]
+    return list(stages.values())
+
+def ticker_rows() -> list[dict]:
+    """Returns one row per (stage, ticker) pair measured for a single ticker."""
+    with _lock:
+        return [{"stage": stage, "ticker": ticker, **record}
+                for (stage, ticker), record in _records.items() if ticker]
+
+def write_metrics(directory: str = "report") -> str:
+    """Writes metrics.json (stages and tickers) and metrics.csv (every row) and returns the JSON path."""
+    os.makedirs(directory, exist_ok=True)
+    stages, tickers = stage_rows(), ticker_rows()
+    json_path = os.path.join(directory, "metrics.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"stages": stages, "tickers": tickers}, f, indent=2)
+    with open(os.path.join(directory, "metrics.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=("stage", "ticker") + FIELDS)
+        writer.writeheader()
+        for row in stages:
+            writer.writerow({"ticker": "", **{k: v for k, v in row.items() if k != "tickers"}})
+        writer.writerows(tickers)
+    return json_path
+
+def log_summary():
+    """Logs the per-stage totals as a table."""
+    rows = stage_rows()
+    if not rows:
+        return
+    lines = [f"{'stage':<12} {'tickers':>7} {'wall s':>8} {'cpu s':>8} {'KB':>9} {'api':>5} {'cached':>6}"]
+    for row in rows:
+        lines.append(f"{row['stage']:<12} {row['tickers']:>7} {row['wall_s']:>8.2f} {row['cpu_s']:>8.2f} "
+                     f"{row['bytes'] / 1024:>9.1f} {row['api_calls']:>5} {row['cache_hits']:>6}")
+    logging.info("Stage metrics:\n" + "\n".join(lines))
+
+@contextmanager
+def profiled(mode: str = None, directory: str = "report"):
+    """Profiles the block with cProfile or pyinstrument according to mode (PROFILE by default)."""
+    mode = PROFILE if mode is None else mode
+    if mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "profile.prof")
+            profiler.dump_stats(path)
+            logging.info(f"cProfile stats written to {path}")
+    elif mode == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logging.warning("pyinstrument is not installed; running without profiling.")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "profile.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            logging.info(f"pyinstrument profile written to {path}")
+    else:
+        yield
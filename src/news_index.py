@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import metrics
+
+# Processed articles (summary + sentiment) are remembered here for SEEN_RETENTION_DAYS
+# so later runs reuse them instead of summarizing and scoring the same story again.
+SEEN_STORE_PATH = os.environ.get("SEEN_STORE_PATH", os.path.join("data", "seen_articles.sqlite"))
+SEEN_RETENTION_DAYS = int(os.environ.get("SEEN_RETENTION_DAYS", 7))
+
+# Query parameters that only track the click and never change the article
+_TRACKING_PARAMS = re.compile(r"^(utm_.*|oc|guccounter|guce_.*|ncid|soc_.*|cmpid|ref|src)$")
+
+def normalize_url(url: str) -> str:
+    """Canonicalizes an article URL so tracking variants of the same link compare equal."""
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if not _TRACKING_PARAMS.match(k.lower())))
+    return urlunsplit(("https", host, parts.path.rstrip("/"), query, ""))
+
+def title_fingerprint(title: str) -> str:
+    """Hashes a headline with the publisher suffix, case and punctuation removed."""
+    if not title:
+        return ""
+    # Google News appends " - Publisher" to every headline
+    head, sep, tail = title.rpartition(" - ")
+    if sep and head and len(tail.split()) <= 5:
+        title = head
+    words = re.sub(r"[^\w\s]", " ", title.lower()).split()
+    return hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest() if words else ""
+
+def build_article_index(articles_by_ticker: Dict[str, List[Dict]]) -> tuple[list[dict], dict[str, list[int]]]:
+    """Groups copies of the same article fetched for different tickers.
+
+    Two articles are the same when their normalized URLs or their title
+    fingerprints match. Returns the unique entries ({'article', 'url_key',
+    'title_key', 'tickers'}) and, per ticker, the indices of its entries in
+    the order they were fetched (duplicates within a ticker are dropped).
+    """
+    entries, by_url, by_title, ticker_entries = [], {}, {}, {}
+    for ticker, articles in articles_by_ticker.items():
+        indices = ticker_entries.setdefault(ticker, [])
+        for article in articles:
+            url_key = normalize_url(article.get('link', ''))
+            title_key = title_fingerprint(article.get('title') or article.get('headline') or '')
+            index = by_url.get(url_key) if url_key else None
+            if index is None and title_key:
+                index = by_title.get(title_key)
+            if index is None:
+                index = len(entries)
+                entries.append({'article': article, 'url_key': url_key, 'title_key': title_key, 'tickers': []})
+            if url_key:
+                by_url.setdefault(url_key, index)
+            if title_key:
+                by_title.setdefault(title_key, index)
+            if ticker not in entries[index]['tickers']:
+                entries[index]['tickers'].append(ticker)
+            if index not in indices:
+                indices.append(index)
+    return entries, ticker_entries
+
+def _connect() -> sqlite3.Connection:
+    if os.path.dirname(SEEN_STORE_PATH):
+        os.makedirs(os.path.dirname(SEEN_STORE_PATH), exist_ok=True)
+    conn = sqlite3.connect(SEEN_STORE_PATH, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS seen (url_key TEXT, title_key TEXT, processed TEXT, seen_at REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS seen_url ON seen (url_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS seen_title ON seen (title_key)")
+    return conn
+
+def _lookup_seen(conn: sqlite3.Connection, entry: dict):
+    for column in ("url_key", "title_key"):
+        if entry[column]:
+            row = conn.execute(f"SELECT processed FROM seen WHERE {column} = ? ORDER BY seen_at DESC LIMIT 1",
+                               (entry[column],)).fetchone()
+            if row:
+                return json.loads(row[0])
+    return None
+
+def _process_chunks(articles: List[Dict], process, executor, chunks: int) -> List[Dict]:
+    """Runs process over articles split into up to chunks slices on executor, keeping their order."""
+    if executor is None or chunks <= 1 or len(articles) <= 1:
+        return process(articles)
+    size = -(-len(articles) // chunks)
+    slices = [articles[start:start + size] for start in range(0, len(articles), size)]
+    processed = []
+    for result, record in executor.map(metrics.call_tracked, [process] * len(slices), slices):
+        # Worker threads have no stage of their own; their counters go to the caller's
+        for field in metrics.COUNTERS:
+            metrics.count(field, record[field])
+        processed.extend(result)
+    return processed
+
+def process_articles_once(articles_by_ticker: Dict[str, List[Dict]], process, executor=None,
+                          chunks: int = 1) -> Dict[str, List[Dict]]:
+    """Runs process (e.g. summarizer.process_articles) once per unique article across all tickers.
+
+    Articles already processed within SEEN_RETENTION_DAYS are taken from
+    the seen store; results flagged llm_summary=False (fallback summaries)
+    are not stored. With a thread pool executor, the articles left to
+    process are split into chunks that run in parallel. Returns the
+    processed articles for each ticker.
+    """
+    entries, ticker_entries = build_article_index(articles_by_ticker)
+    results = {}
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM seen WHERE seen_at < ?", (time.time() - SEEN_RETENTION_DAYS * 86400,))
+        for i, entry in enumerate(entries):
+            processed = _lookup_seen(conn, entry)
+            if processed is not None:
+                results[i] = processed
+
+        todo = [i for i in range(len(entries)) if i not in results]
+        fetched = sum(len(articles) for articles in articles_by_ticker.values())
+        print(f"Article index: {fetched} fetched, {len(entries)} unique, "
+              f"{len(entries) - len(todo)} already processed, {len(todo)} to process.")
+        if todo:
+            for i, processed in zip(todo, _process_chunks([entries[i]['article'] for i in todo], process, executor, chunks)):
+                results[i] = processed
+                if processed.get('llm_summary') is False:
+                    # Fallback summaries are not kept, so a later run can summarize them properly
+                    continue
+                conn.execute("INSERT INTO seen (url_key, title_key, processed, seen_at) VALUES (?, ?, ?, ?)",
+                             (entries[i]['url_key'], entries[i]['title_key'], json.dumps(processed), time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+    return {ticker: [results[i] for i in indices] for ticker, indices in ticker_entries.items()}
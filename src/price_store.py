@@ -0,0 +1,222 @@
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import timedelta
+from typing import Dict, List
+
+import pandas as pd
+
+import metrics
+from fetchers import HISTORY_COLUMNS, HISTORY_CHUNK_SIZE, fetch_history_bulk
+
+# SQLite file holding daily OHLCV bars for every tracked ticker.
+# Keep the directory in the GitHub Actions cache to reuse it between runs.
+PRICE_STORE_PATH = os.environ.get("PRICE_STORE_PATH", os.path.join("data", "prices.sqlite"))
+# Tickers refreshed less than this many seconds ago are served from disk without any request
+PRICE_STORE_TTL = int(os.environ.get("PRICE_STORE_TTL", 6 * 3600))
+# Recent bars re-downloaded on every refresh so revised (or partial intraday) bars get corrected
+REVISION_DAYS = int(os.environ.get("PRICE_STORE_REVISION_DAYS", 5))
+# Stores whose newest bar is older than this are considered stale and fetched in full again
+MAX_STALE_DAYS = int(os.environ.get("PRICE_STORE_MAX_STALE_DAYS", 30))
+# Relative close-price change in the overlap above which history is assumed re-adjusted
+REVISION_TOLERANCE = 0.005
+
+_DB_COLUMNS = {col: col.lower().replace(" ", "_") for col in HISTORY_COLUMNS}
+
+def _connect(path: str = None) -> sqlite3.Connection:
+    """Opens the store and creates its tables on first use."""
+    path = path or PRICE_STORE_PATH
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    columns = ", ".join(f"{name} REAL" for name in _DB_COLUMNS.values())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS bars (ticker TEXT, date TEXT, {columns}, PRIMARY KEY (ticker, date))")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (ticker TEXT PRIMARY KEY, refreshed_at REAL, tz TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS indicator_state (ticker TEXT PRIMARY KEY, state TEXT)")
+    return conn
+
+_PERIOD = re.compile(r"^(\d+)(d|mo|y)$")
+_PERIOD_UNITS = {"d": "days", "mo": "months", "y": "years"}
+
+def _period_start(period: str, now: pd.Timestamp) -> pd.Timestamp | None:
+    """Converts a yfinance period string ('5d', '6mo', '1y', 'ytd', 'max') to its first date.
+
+    Returns None for 'max' (no cutoff); unsupported periods raise ValueError.
+    """
+    period = period.strip().lower()
+    if period == "max":
+        return None
+    if period == "ytd":
+        return now.normalize().replace(month=1, day=1)
+    match = _PERIOD.match(period)
+    if not match:
+        raise ValueError(f"Unsupported period: {period}")
+    return now - pd.DateOffset(**{_PERIOD_UNITS[match.group(2)]: int(match.group(1))})
+
+def load_history(ticker: str, conn: sqlite3.Connection = None) -> pd.DataFrame:
+    """Loads the stored bars for a ticker as a frame shaped like fetch_history (empty if unknown)."""
+    own = conn is None
+    conn = conn or _connect()
+    try:
+        names = ", ".join(_DB_COLUMNS.values())
+        rows = conn.execute(f"SELECT date, {names} FROM bars WHERE ticker = ? ORDER BY date", (ticker,)).fetchall()
+        meta = conn.execute("SELECT tz FROM meta WHERE ticker = ?", (ticker,)).fetchone()
+    finally:
+        if own:
+            conn.close()
+    df = pd.DataFrame([row[1:] for row in rows], columns=list(_DB_COLUMNS), index=pd.to_datetime([row[0] for row in rows]))
+    if meta and meta[0]:
+        df.index = df.index.tz_localize(meta[0])
+    df.index.name = "Date"
+    if "Volume" in df.columns and df["Volume"].notna().all():
+        df["Volume"] = df["Volume"].astype("int64")
+    # Drop columns yfinance never returned for this ticker (e.g. Capital Gains for stocks)
+    return df.dropna(axis=1, how="all") if not df.empty else df
+
+def save_history(ticker: str, hist: pd.DataFrame, conn: sqlite3.Connection, replace: bool = False):
+    """Upserts bars for a ticker; replace=True drops everything stored before."""
+    if replace:
+        conn.execute("DELETE FROM bars WHERE ticker = ?", (ticker,))
+    if not hist.empty:
+        values = hist.reindex(columns=list(_DB_COLUMNS)).astype(float)
+        values = values.where(values.notna(), None)
+        dates = hist.index.strftime("%Y-%m-%d")
+        placeholders = ", ".join("?" for _ in range(len(_DB_COLUMNS) + 2))
+        conn.executemany(
+            f"INSERT OR REPLACE INTO bars (ticker, date, {', '.join(_DB_COLUMNS.values())}) VALUES ({placeholders})",
+            [(ticker, date, *row) for date, row in zip(dates, values.itertuples(index=False, name=None))],
+        )
+    tz = str(hist.index.tz) if getattr(hist.index, "tz", None) is not None else None
+    conn.execute("INSERT OR REPLACE INTO meta (ticker, refreshed_at, tz) VALUES (?, ?, ?)", (ticker, time.time(), tz))
+
+def load_histories(tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """Loads the stored bars of many tickers over one connection, leaving out unknown ones."""
+    conn = _connect()
+    try:
+        histories = {ticker: load_history(ticker, conn) for ticker in dict.fromkeys(tickers)}
+    finally:
+        conn.close()
+    return {ticker: hist for ticker, hist in histories.items() if not hist.empty}
+
+def save_histories(histories: Dict[str, pd.DataFrame]):
+    """Upserts the bars of many tickers in one transaction."""
+    conn = _connect()
+    try:
+        for ticker, hist in histories.items():
+            save_history(ticker, hist, conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _was_revised(stored: pd.DataFrame, fresh: pd.DataFrame) -> bool:
+    """Detects re-adjusted history: overlapping closes moved, or a new dividend/split arrived."""
+    new_bars = fresh[fresh.index > stored.index[-1]]
+    for col in ("Dividends", "Stock Splits"):
+        if col in new_bars.columns and (new_bars[col].fillna(0) != 0).any():
+            return True
+    overlap = stored.index.intersection(fresh.index)
+    if overlap.empty:
+        return False
+    old, new = stored.loc[overlap, "Close"], fresh.loc[overlap, "Close"]
+    # The newest stored bar may have been a partial intraday bar, so it is allowed to change
+    old, new = old.iloc[:-1], new.iloc[:-1]
+    return bool(((new - old).abs() > REVISION_TOLERANCE * old.abs()).any())
+
+def refresh_histories(tickers: List[str], period: str = "1y", chunk_size: int = HISTORY_CHUNK_SIZE) -> Dict[str, pd.DataFrame]:
+    """Returns per-ticker history for the period, downloading only what the store is missing.
+
+    Fresh tickers (within PRICE_STORE_TTL) are read from disk. Others fetch
+    the bars after their last stored date plus a REVISION_DAYS overlap, so
+    revised bars are overwritten. Empty or stale stores, and histories that
+    were re-adjusted for a dividend or split, are downloaded in full. All
+    downloads finish before the new bars are written in one transaction.
+    """
+    now = pd.Timestamp.now()
+    # Computed first so an unsupported period fails before any download
+    period_start = _period_start(period, now)
+    unique = list(dict.fromkeys(tickers))
+    conn = _connect()
+    try:
+        stored = {ticker: load_history(ticker, conn) for ticker in unique}
+        refreshed = dict(conn.execute("SELECT ticker, refreshed_at FROM meta").fetchall())
+    finally:
+        conn.close()
+
+    full, incremental, served = [], {}, 0
+    for ticker in unique:
+        hist = stored[ticker]
+        if hist.empty or (now - hist.index[-1].tz_localize(None)).days > MAX_STALE_DAYS:
+            full.append(ticker)
+        elif time.time() - refreshed.get(ticker, 0) >= PRICE_STORE_TTL:
+            start = (hist.index[-1].tz_localize(None) - timedelta(days=REVISION_DAYS)).strftime("%Y-%m-%d")
+            incremental.setdefault(start, []).append(ticker)
+        else:
+            served += 1
+            metrics.count("cache_hits")
+    print(f"Price store: {served} fresh, {sum(len(g) for g in incremental.values())} incremental, "
+          f"{len(full)} full downloads.")
+
+    # Everything is downloaded before the first write, so the store is only locked
+    # for one short transaction and never while waiting on the network
+    updates = {}
+    # Tickers sharing a last stored date (the usual case) share one bulk request
+    for start, group in incremental.items():
+        fresh = fetch_history_bulk(group, period=period, chunk_size=chunk_size, start=start)
+        for ticker in group:
+            if ticker not in fresh:
+                print(f"No new bars for {ticker}; serving stored history.")
+            elif _was_revised(stored[ticker], fresh[ticker]):
+                print(f"History for {ticker} was re-adjusted; downloading it in full.")
+                full.append(ticker)
+            else:
+                updates[ticker] = (fresh[ticker], False)
+    if full:
+        fresh = fetch_history_bulk(full, period=period, chunk_size=chunk_size)
+        updates.update((ticker, (hist, True)) for ticker, hist in fresh.items())
+    if not updates:
+        return _trim(stored, period_start)
+
+    conn = _connect()
+    try:
+        for ticker, (hist, replace) in updates.items():
+            save_history(ticker, hist, conn, replace=replace)
+        conn.commit()
+        for ticker in updates:
+            stored[ticker] = load_history(ticker, conn)
+    finally:
+        conn.close()
+
+    return _trim(stored, period_start)
+
+def _trim(stored: Dict[str, pd.DataFrame], period_start: pd.Timestamp | None) -> Dict[str, pd.DataFrame]:
+    """Drops empty histories and the bars before period_start (None keeps them all)."""
+    histories = {}
+    for ticker, hist in stored.items():
+        if hist.empty:
+            continue
+        if period_start is None:
+            histories[ticker] = hist
+            continue
+        cutoff = period_start.tz_localize(hist.index.tz) if hist.index.tz is not None else period_start
+        histories[ticker] = hist[hist.index >= cutoff]
+    return histories
+
+def load_indicator_state(ticker: str) -> dict:
+    """Returns the saved incremental indicator state for a ticker, or None."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT state FROM indicator_state WHERE ticker = ?", (ticker,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+def save_indicator_state(ticker: str, state: dict):
+    """Persists the incremental indicator state for a ticker."""
+    conn = _connect()
+    try:
+        conn.execute("INSERT OR REPLACE INTO indicator_state (ticker, state) VALUES (?, ?)", (ticker, json.dumps(state)))
+        conn.commit()
+    finally:
+        conn.close()
@@ -1,9 +1,40 @@
+import json
 import os
-try:
-    from groq import Groq
-except Exception:
-    Groq = None
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from llm_cache import cached_completion, get_client
+
+SUMMARY_SYSTEM_PROMPT = "You are a financial news analyst. Summarize the following article for an investor in 2-3 concise sentences. Focus on the key facts, figures, and potential market impact. Ignore boilerplate text."
+
+SUMMARY_BATCH_SYSTEM_PROMPT = (
+    "You are a financial news analyst. You will receive numbered news items. Summarize each one for an "
+    "investor in 2-3 concise sentences, focusing on key facts, figures, and potential market impact. "
+    'Respond with JSON only, in the form {"summaries": ["summary of item 1", "summary of item 2", ...]}, '
+    "with exactly one summary per item, in the same order."
+)
+# Headlines packed into one completion when > 1 (1 keeps one request per article)
+SUMMARY_BATCH_SIZE = int(os.environ.get("SUMMARY_BATCH_SIZE", 1))
+# Character budget for the numbered items of one batch, kept well inside llama3-8b-8192's
+# 8k-token context so the JSON answer still fits (roughly 4 characters per token)
+SUMMARY_BATCH_MAX_CHARS = int(os.environ.get("SUMMARY_BATCH_MAX_CHARS", 12000))
+
+# Batches at least this large are spread across processes when get_sentiments gets workers
+SENTIMENT_POOL_MIN_BATCH = int(os.environ.get("SENTIMENT_POOL_MIN_BATCH", 2000))
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+def get_analyzer():
+    """Returns the process-wide VADER SentimentIntensityAnalyzer, loading the lexicon on first use."""
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+                _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
 
 def summarize_with_groq(client, text: str) -> str:
     """Uses Groq API to summarize a given text. Returns fallback text on failure or missing client."""
@@ -11,31 +42,87 @@ def summarize_with_groq(client, text: str) -> str:
         return "No content to summarize."
     if client is None:
         # Fallback summarization: return the first sentence or trimmed headline
-        return text if len(text) < 300 else text[:300] + '...'
+        return _fallback_summary(text)
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a financial news analyst. Summarize the following article for an investor in 2-3 concise sentences. Focus on the key facts, figures, and potential market impact. Ignore boilerplate text."
-                },
-                {
-                    "role": "user",
-                    "content": text,
-                }
-            ],
-            model="llama3-8b-8192",
-        )
-        return chat_completion.choices[0].message.content
+        return cached_completion(client, "llama3-8b-8192", SUMMARY_SYSTEM_PROMPT, text)
     except Exception as e:
         print(f"Error summarizing with Groq: {e}")
-        return text if len(text) < 300 else text[:300] + '...'
+        return _fallback_summary(text)
 
-def get_sentiment(text: str) -> dict:
-    """Gets sentiment score using VADER."""
-    analyzer = SentimentIntensityAnalyzer()
-    sentiment = analyzer.polarity_scores(text)
-    # Classify sentiment based on compound score
+def _fallback_summary(text: str) -> str:
+    return text if len(text) < 300 else text[:300] + '...'
+
+def _pack_batches(texts: list[str], batch_size: int, max_chars: int) -> list[list[int]]:
+    """Groups text indices into batches bounded by item count and total characters."""
+    batches, current, size = [], [], 0
+    for i, text in enumerate(texts):
+        if current and (len(current) >= batch_size or size + len(text) > max_chars):
+            batches.append(current)
+            current, size = [], 0
+        current.append(i)
+        size += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_batch_response(content: str, expected: int):
+    """Extracts the list of summaries from a batch completion, or None if it is malformed."""
+    if not content:
+        return None
+    match = re.search(r"[\[{].*[\]}]", content, re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+    items = data.get("summaries") if isinstance(data, dict) else data
+    if not isinstance(items, list) or len(items) != expected:
+        return None
+    summaries = [item.get("summary") if isinstance(item, dict) else item for item in items]
+    if not all(isinstance(summary, str) and summary.strip() for summary in summaries):
+        return None
+    return [summary.strip() for summary in summaries]
+
+def summarize_batch_with_groq(client, texts: list[str], batch_size: int = None, max_chars: int = None) -> list[str]:
+    """Summarizes many texts with one completion per batch of numbered items.
+
+    Returns summaries in input order. A batch whose answer cannot be parsed
+    back into one summary per item is retried item by item; if the request
+    itself fails the batch gets the same truncated fallback as summarize_with_groq.
+    """
+    batch_size = batch_size or SUMMARY_BATCH_SIZE
+    max_chars = max_chars or SUMMARY_BATCH_MAX_CHARS
+    summaries = [None if text else "No content to summarize." for text in texts]
+    pending = [i for i, text in enumerate(texts) if text]
+    if client is None:
+        for i in pending:
+            summaries[i] = _fallback_summary(texts[i])
+        return summaries
+
+    for batch in _pack_batches([texts[i] for i in pending], max(1, batch_size), max_chars):
+        indices = [pending[j] for j in batch]
+        if len(indices) == 1:
+            summaries[indices[0]] = summarize_with_groq(client, texts[indices[0]])
+            continue
+        prompt = "\n".join(f"{n}. {texts[i]}" for n, i in enumerate(indices, start=1))
+        try:
+            parsed = _parse_batch_response(
+                cached_completion(client, "llama3-8b-8192", SUMMARY_BATCH_SYSTEM_PROMPT, prompt), len(indices))
+        except Exception as e:
+            print(f"Error summarizing batch with Groq: {e}")
+            for i in indices:
+                summaries[i] = _fallback_summary(texts[i])
+            continue
+        if parsed is None:
+            print(f"Could not parse batch summary for {len(indices)} items; summarizing them one by one.")
+            parsed = [summarize_with_groq(client, texts[i]) for i in indices]
+        for i, summary in zip(indices, parsed):
+            summaries[i] = summary
+    return summaries
+
+def _label(sentiment: dict) -> dict:
+    """Classifies sentiment based on the compound score."""
     if sentiment['compound'] >= 0.05:
         sentiment['label'] = 'Positive'
     elif sentiment['compound'] <= -0.05:
@@ -44,23 +131,52 @@ def get_sentiment(text: str) -> dict:
         sentiment['label'] = 'Neutral'
     return sentiment
 
+def get_sentiment(text: str) -> dict:
+    """Gets sentiment score using VADER."""
+    return _label(get_analyzer().polarity_scores(text))
+
+def _score_chunk(texts: list[str]) -> list[dict]:
+    return [get_sentiment(text) for text in texts]
+
+def get_sentiments(texts: list[str], workers: int = None) -> list[dict]:
+    """Scores many texts with the shared analyzer, in input order.
+
+    With workers set, batches of at least SENTIMENT_POOL_MIN_BATCH texts are
+    split into chunks and scored on a process pool.
+    """
+    if not workers or workers < 2 or len(texts) < SENTIMENT_POOL_MIN_BATCH:
+        return _score_chunk(texts)
+    size = -(-len(texts) // workers)
+    chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [score for chunk in executor.map(_score_chunk, chunks) for score in chunk]
+
 def process_articles(articles: list[dict]) -> list[dict]:
-    """Summarizes and analyzes sentiment for a list of articles."""
-    groq_key = os.environ.get("GROQ_API_KEY")
-    client = Groq(api_key=groq_key) if (Groq is not None and groq_key) else None
+    """Summarizes and analyzes sentiment for a list of articles.
+
+    Each result's 'llm_summary' is False when its summary is the truncated
+    fallback (no client, or the Groq request failed), so callers that keep
+    results across runs can process those articles again later.
+    """
+    client = get_client()
     processed = []
 
-    for article in articles:
-        summary = summarize_with_groq(client, article.get('title') or article.get('headline') or '')
-        sentiment = get_sentiment(summary)
+    texts = [article.get('title') or article.get('headline') or '' for article in articles]
+    if client is not None and SUMMARY_BATCH_SIZE > 1:
+        summaries = summarize_batch_with_groq(client, texts)
+    else:
+        summaries = [summarize_with_groq(client, text) for text in texts]
+    sentiments = get_sentiments(summaries)
 
+    for article, text, summary, sentiment in zip(articles, texts, summaries, sentiments):
         processed.append({
             "headline": article.get('title') or article.get('headline') or '',
             "summary": summary,
             "sentiment_score": sentiment['compound'],
             "sentiment_label": sentiment['label'],
             "link": article.get('link', ''),
-            "source": article.get('source', '')
+            "source": article.get('source', ''),
+            "llm_summary": client is not None and bool(text) and summary != _fallback_summary(text),
         })
     print(f"Processed {len(processed)} articles with Groq (if available) and VADER.")
     return processed
@@ -1,15 +1,40 @@
-import pandas as pd
-import mplfinance as mpf
+import glob
+import hashlib
+import os
 import base64
-from io import BytesIO
-import matplotlib.pyplot as plt
+from html import escape
+from io import BytesIO, StringIO
+from string import Template
 
-def generate_chart(df: pd.DataFrame, ticker: str) -> str:
-    """Generates a candlestick chart and returns it as a base64 string."""
-    # Ensure dataframe is sliced for recent data to make chart readable
-    data = df.tail(120) # Last ~6 months approx
+import pandas as pd
+
+import metrics
+
+# Bars shown on every chart (~6 months)
+CHART_BARS = 120
+CHART_DPI = int(os.environ.get('CHART_DPI', 100))
+# Optional figure size in inches, as WIDTHxHEIGHT (mplfinance's default when unset)
+CHART_SIZE = tuple(float(v) for v in os.environ['CHART_SIZE'].lower().split('x')) if os.environ.get('CHART_SIZE') else None
+# Rendered images are cached here, keyed on the bars they show
+CHART_CACHE_DIR = os.environ.get('CHART_CACHE_DIR', os.path.join('data', 'charts'))
+CHART_MIME = {'candle': 'image/png', 'sparkline': 'image/svg+xml'}
+
+def _plotting():
+    """Imports matplotlib (Agg) and mplfinance on first use; sparklines and reports never need them."""
+    import matplotlib
+    matplotlib.use('Agg')  # headless backend; must be chosen before pyplot is imported
+    import matplotlib.pyplot as plt
+    import mplfinance as mpf
+    return plt, mpf
+
+def init_chart_worker():
+    """Process-pool initializer: pays the matplotlib/mplfinance setup once per worker."""
+    plt, _ = _plotting()
+    plt.rcParams['figure.max_open_warning'] = 0
 
-    # Plotting
+def _render_candle(data: pd.DataFrame, ticker: str) -> bytes:
+    plt, mpf = _plotting()
+    size = {'figsize': CHART_SIZE} if CHART_SIZE else {}
     fig, axlist = mpf.plot(data,
                            type='candle',
                            style='yahoo',
@@ -18,105 +43,229 @@ def generate_chart(df: pd.DataFrame, ticker: str) -> str:
                            mav=(20, 50),
                            volume=True,
                            show_nontrading=False,
-                           returnfig=True)
-
-    # Save to a bytes buffer
+                           returnfig=True,
+                           **size)
     buf = BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-
-    # Encode in base64
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    buf.close()
-
-    # Close the figure to free memory
     try:
+        fig.savefig(buf, format='png', dpi=CHART_DPI, bbox_inches='tight')
+    finally:
+        # Close the figure to free memory
         plt.close(fig)
-    except Exception:
-        pass
+    return buf.getvalue()
+
+def _render_sparkline(data: pd.DataFrame, ticker: str, width: int = 320, height: int = 64) -> bytes:
+    """Draws the closes as a small SVG polyline; no matplotlib involved."""
+    closes = data['Close'].astype(float).tolist()
+    low, high = min(closes), max(closes)
+    span = (high - low) or 1.0
+    step = (width - 2) / max(len(closes) - 1, 1)
+    points = " ".join(f"{1 + i * step:.1f},{height - 1 - (c - low) / span * (height - 14):.1f}"
+                      for i, c in enumerate(closes))
+    color = "#4caf50" if closes[-1] >= closes[0] else "#ff4d4d"
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+           f'<text x="2" y="11" font-family="Arial" font-size="11" fill="#333">{ticker} {closes[-1]:.2f}</text>'
+           f'<polyline fill="none" stroke="{color}" stroke-width="1.5" points="{points}"/></svg>')
+    return svg.encode('utf-8')
+
+def render_chart(df: pd.DataFrame, ticker: str, kind: str = 'candle') -> tuple[bytes, str]:
+    """Renders a 'candle' PNG or 'sparkline' SVG of the last CHART_BARS bars; returns (image, mime type).
+
+    Images are cached on disk under a hash of the bars and chart settings, so
+    a ticker whose recent bars did not change is not rendered again.
+    """
+    if kind not in CHART_MIME:
+        raise ValueError(f"Unknown chart kind: {kind}")
+    data = df.tail(CHART_BARS)[['Open', 'High', 'Low', 'Close', 'Volume']]
+    digest = hashlib.sha256()
+    digest.update(f"{ticker}|{kind}|{CHART_DPI}|{CHART_SIZE}".encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    extension = 'png' if kind == 'candle' else 'svg'
+    prefix = os.path.join(CHART_CACHE_DIR, f"{ticker}-{kind}-")
+    path = f"{prefix}{digest.hexdigest()[:16]}.{extension}"
 
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            metrics.count("cache_hits")
+            print(f"Reused cached chart for {ticker}.")
+            return f.read(), CHART_MIME[kind]
+
+    image = _render_candle(data, ticker) if kind == 'candle' else _render_sparkline(data, ticker)
+    try:
+        os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+        for stale in glob.glob(f"{glob.escape(prefix)}*"):
+            os.remove(stale)
+        with open(path, 'wb') as f:
+            f.write(image)
+    except OSError as e:
+        print(f"Could not cache chart for {ticker}: {e}")
     print(f"Generated chart for {ticker}.")
-    return img_base64
+    return image, CHART_MIME[kind]
+
+def generate_chart(df: pd.DataFrame, ticker: str) -> str:
+    """Generates a candlestick chart and returns it as a base64 string."""
+    image, _ = render_chart(df, ticker)
+    return base64.b64encode(image).decode('ascii')
+
+# --- Report rendering ---
+# Templates are compiled once; the report is written section by section so memory
+# use stays flat no matter how many tickers are in the watchlist.
+_REPORT_HEAD = Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+    body { font-family: Arial, sans-serif; margin: 20px; color: #333; }
+    .container { max-width: 800px; margin: auto; border: 1px solid #ddd; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+    h1 { color: #2c3e50; }
+    h2 { color: #34495e; border-bottom: 2px solid #3498db; padding-bottom: 5px; }
+    h3 { color: #34495e; }
+    details { border: 1px solid #ddd; border-radius: 4px; margin-bottom: 15px; }
+    summary { font-size: 1.2em; font-weight: bold; padding: 10px; cursor: pointer; background-color: #f2f2f2; }
+    .ticker-section { padding: 10px; }
+    .analyst-opinion { background-color: #eaf2f8; border-left: 4px solid #3498db; padding: 10px; margin: 10px 0; }
+    .news-table { width: 100%; border-collapse: collapse; }
+    .news-table th, .news-table td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+    .news-table th { background-color: #f2f2f2; }
+</style>
+</head>
+<body>
+<div class="container">
+    <h1>📈 $title</h1>
+""")
+_REPORT_TAIL = """</div>
+</body>
+</html>
+"""
+_TICKER_SECTION = Template("""    <details open>
+        <summary>
+            <h2>$ticker - Daily Report</h2>
+        </summary>
+        <div class="ticker-section">
+            <h3>🤖 AI Analyst Opinion</h3>
+            <p class="analyst-opinion">$opinion</p>
+            <p><b>Action Triggered:</b> $action ($reason)</p>
+$error
+            <h3>📈 Technical Summary</h3>
+            <p>
+                <b>Close:</b> $$$close |
+                <b>SMA20:</b> $$$sma20 |
+                <b>SMA50:</b> $$$sma50 |
+                <b>RSI:</b> $rsi
+            </p>
+$chart
+
+            <h3>🗞️ Recent News</h3>
+""")
+_SECTION_TAIL = """        </div>
+    </details>
+"""
+_NEWS_HEAD = """            <table class="news-table">
+                <tr><th>Headline</th><th>Summary</th><th>Sentiment</th><th>Source</th></tr>
+"""
+_NEWS_ROW = Template("""                <tr>
+                    <td><a href="$link">$headline</a></td>
+                    <td>$summary</td>
+                    <td style="$color">$label ($score)</td>
+                    <td>$source</td>
+                </tr>
+""")
+_NEWS_TAIL = "            </table>\n"
+_NO_NEWS = "            <p>No recent news found.</p>\n"
+_DIGEST_QUIET = Template("""    <p><b>No triggers:</b> $tickers</p>
+""")
+
+def _tech_value(tech: dict, key: str, default=0):
+    value = tech.get(key, default)
+    return value if isinstance(value, (int, float)) else tech.get(key, 'N/A')
 
-def render_html_report(report_data: list[dict]) -> str:
-    """Renders the final HTML report from the processed data."""
-    ticker_sections_html = ""
+def _chart_src(data: dict, chart_mode: str, asset_dir: str, attachments: list) -> str:
+    """Returns the img src for a ticker's chart, writing or attaching the image as needed."""
+    image, mime = data.get('chart'), data.get('chart_mime', 'image/png')
+    if not image:
+        return ''
+    if isinstance(image, str):
+        # Already base64 encoded (the historical report_data format)
+        image = base64.b64decode(image)
+    extension = 'svg' if mime == 'image/svg+xml' else 'png'
+    name = f"{data.get('ticker', 'chart')}.{extension}"
+    if chart_mode == 'files':
+        os.makedirs(asset_dir, exist_ok=True)
+        with open(os.path.join(asset_dir, name), 'wb') as f:
+            f.write(image)
+        return f"{os.path.basename(os.path.normpath(asset_dir))}/{name}"
+    if chart_mode == 'cid':
+        cid = f"chart-{len(attachments)}-{data.get('ticker', 'chart')}"
+        attachments.append({'cid': cid, 'data': image, 'mime': mime, 'filename': name})
+        return f"cid:{cid}"
+    return f"data:{mime};base64,{base64.b64encode(image).decode('ascii')}"
+
+def _chart_img(data: dict, chart_mode: str, asset_dir: str, attachments: list) -> str:
+    """Returns the chart's img tag, or nothing when the ticker has no chart (e.g. --no-charts)."""
+    src = _chart_src(data, chart_mode, asset_dir, attachments)
+    if not src:
+        return ""
+    ticker = escape(str(data.get('ticker', 'UNKNOWN')))
+    return f'            <img src="{src}" alt="{ticker} chart" style="width:100%; max-width:700px;">'
+
+def write_html_report(report_data: list[dict], out, chart_mode: str = 'inline', asset_dir: str = None,
+                      digest: bool = False) -> list[dict]:
+    """Streams the HTML report to out (any object with a write(str) method).
+
+    chart_mode is 'inline' (base64 data URIs), 'files' (images written to
+    asset_dir, a directory next to the report, and linked relatively) or
+    'cid' (referenced as cid: URLs and returned as attachments for
+    mailer.send_email). digest=True keeps only ESCALATE tickers plus a
+    one-line list of the others. Returns the attachments for 'cid' mode.
+    """
+    if chart_mode == 'files' and not asset_dir:
+        raise ValueError("asset_dir is required when chart_mode='files'")
+    attachments = []
+    out.write(_REPORT_HEAD.substitute(title="Stock Watcher Digest" if digest else "Daily Stock Watcher Report"))
+    quiet = []
     for data in report_data:
-        # News Table
-        news_html = ""
+        controller = data.get('controller_output', {})
+        if digest and controller.get('action') != 'ESCALATE' and not data.get('error'):
+            quiet.append(data.get('ticker', 'UNKNOWN'))
+            continue
+        tech = data.get('tech', {})
+        error = data.get('error')
+        out.write(_TICKER_SECTION.substitute(
+            ticker=escape(str(data.get('ticker', 'UNKNOWN'))),
+            opinion=escape(str(controller.get('analyst_opinion', ''))),
+            action=escape(str(controller.get('action', ''))),
+            reason=escape(str(controller.get('reason', ''))),
+            error=f"            <p><b>Processing failed:</b> {escape(str(error))}</p>" if error else "",
+            close=_tech_value(tech, 'Close'),
+            sma20=_tech_value(tech, 'SMA_20'),
+            sma50=_tech_value(tech, 'SMA_50'),
+            rsi=tech.get('RSI_14', 'N/A'),
+            chart=_chart_img(data, chart_mode, asset_dir, attachments),
+        ))
         if data.get('news'):
-            news_html += """"
-                <table class="news-table">
-                    <tr><th>Headline</th><th>Summary</th><th>Sentiment</th><th>Source</th></tr>
-            """
+            out.write(_NEWS_HEAD)
             for article in data['news']:
-                sentiment_color = "color: #ff4d4d;" if article.get('sentiment_label') == 'Negative' else "color: #4caf50;" if article.get('sentiment_label') == 'Positive' else ""
-                news_html += f""""
-                    <tr>
-                        <td><a href="{article.get('link','')}">{article.get('headline','')}</a></td>
-                        <td>{article.get('summary','')}</td>
-                        <td style="{sentiment_color}">{article.get('sentiment_label','')} ({article.get('sentiment_score',0):.2f})</td>
-                        <td>{article.get('source','')}</td>
-                    </tr>
-                """
-            news_html += "</table>"
+                label = article.get('sentiment_label', '')
+                out.write(_NEWS_ROW.substitute(
+                    link=escape(str(article.get('link', ''))),
+                    headline=escape(str(article.get('headline', ''))),
+                    summary=escape(str(article.get('summary', ''))),
+                    color="color: #ff4d4d;" if label == 'Negative' else "color: #4caf50;" if label == 'Positive' else "",
+                    label=escape(str(label)),
+                    score=f"{article.get('sentiment_score', 0):.2f}",
+                    source=escape(str(article.get('source', ''))),
+                ))
+            out.write(_NEWS_TAIL)
         else:
-            news_html = "<p>No recent news found.</p>"
+            out.write(_NO_NEWS)
+        out.write(_SECTION_TAIL)
+    if quiet:
+        out.write(_DIGEST_QUIET.substitute(tickers=escape(", ".join(quiet))))
+    out.write(_REPORT_TAIL)
+    print(f"Successfully rendered HTML report{' digest' if digest else ''}.")
+    return attachments
 
-        # Ticker Section
-        tech = data.get('tech', {})
-        ticker_sections_html += f""""
-        <details open>
-            <summary>
-                <h2>{data.get('ticker','UNKNOWN')} - Daily Report</h2>
-            </summary>
-            <div class="ticker-section">
-                <h3>🤖 AI Analyst Opinion</h3>
-                <p class="analyst-opinion">{data.get('controller_output',{}).get('analyst_opinion','')}</p>
-                <p><b>Action Triggered:</b> {data.get('controller_output',{}).get('action','')} ({data.get('controller_output',{}).get('reason','')})</p>
-
-                <h3>📈 Technical Summary</h3>
-                <p>
-                    <b>Close:</b> ${tech.get('Close', 0) if isinstance(tech.get('Close',0), (int,float)) else tech.get('Close', 'N/A')} | 
-                    <b>SMA20:</b> ${tech.get('SMA_20', 0) if isinstance(tech.get('SMA_20',0), (int,float)) else tech.get('SMA_20', 'N/A')} | 
-                    <b>SMA50:</b> ${tech.get('SMA_50', 0) if isinstance(tech.get('SMA_50',0), (int,float)) else tech.get('SMA_50', 'N/A')} | 
-                    <b>RSI:</b> {tech.get('RSI_14', 'N/A')}
-                </p>
-                <img src="data:image/png;base64,{data.get('chart','')}" alt="{data.get('ticker','')} chart" style="width:100%; max-width:700px;">
-
-                <h3>🗞️ Recent News</h3>
-                {news_html}
-            </div>
-        </details>
-        """
-
-    # Final HTML
-    html = f""""
-    <!DOCTYPE html>
-    <html>
-    <head>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; color: #333; }}
-        .container {{ max-width: 800px; margin: auto; border: 1px solid #ddd; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-        h1 {{ color: #2c3e50; }}
-        h2 {{ color: #34495e; border-bottom: 2px solid #3498db; padding-bottom: 5px; }}
-        h3 {{ color: #34495e; }}
-        details {{ border: 1px solid #ddd; border-radius: 4px; margin-bottom: 15px; }}
-        summary {{ font-size: 1.2em; font-weight: bold; padding: 10px; cursor: pointer; background-color: #f2f2f2; }}
-        .ticker-section {{ padding: 10px; }}
-        .analyst-opinion {{ background-color: #eaf2f8; border-left: 4px solid #3498db; padding: 10px; margin: 10px 0; }}
-        .news-table {{ width: 100%; border-collapse: collapse; }}
-        .news-table th, .news-table td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-        .news-table th {{ background-color: #f2f2f2; }}
-    </style>
-    </head>
-    <body>
-    <div class="container">
-        <h1>📈 Daily Stock Watcher Report</h1>
-        {ticker_sections_html}
-    </div>
-    </body>
-    </html>
-    """
-    print("Successfully rendered HTML report.")
-    return html
+def render_html_report(report_data: list[dict], digest: bool = False) -> str:
+    """Renders the final HTML report from the processed data, with charts inlined."""
+    buf = StringIO()
+    write_html_report(report_data, buf, digest=digest)
+    return buf.getvalue()